@@ -0,0 +1,145 @@
+'''Benchmark Draw_cml_map on synthetic data: time of each stage (metadata load,
+filtering, raw-data index and ingest, rendering, save), peak memory and size of
+the output, written as json so that results can be compared between versions.
+
+python benchmarks/bench_draw_cml_map.py --links 100 1000 --samples 2880 --out results.json
+
+Every scenario runs in a process of its own, so that its peak memory is its own.
+'''
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic
+
+MODES = {
+    'polylines': {},
+    'geojson': {'as_geojson': True},
+    'vega': {'rawdata_dir': 'rawdata'},
+    'sidecar': {'rawdata_dir': 'rawdata', 'rsl_sidecar': True},
+    'streaming': {'rawdata_dir': 'rawdata', 'rsl_sidecar': True, 'memory_budget_mb': 64}
+}
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, dirs, names in os.walk(path) for name in names)
+
+
+def run_scenario(data_dir, out_dir, mode, options):
+    # draw one map, with the stage times from the stats returned by the call. Ingest is
+    # the time spent on the raw data of each link, summed over the links (and over the
+    # processes with workers). Without workers the links are ingested while drawing, so
+    # rendering is the draw time without the ingest.
+    from draw_cml_map import Draw_cml_map
+    warnings.simplefilter('ignore')
+    os.environ['PYTHONWARNINGS'] = 'ignore'  # and in the raw-data workers
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        stats = Draw_cml_map()(out_path=out_dir,
+                               data_path=data_dir,
+                               metadata_file_name='metadata.csv',
+                               name_of_map_file='map',
+                               **dict(MODES[mode], **options))
+    total = time.perf_counter() - t0
+    stages = {name: stage['seconds'] for name, stage in stats.stages.items()}
+    stages['rendering'] = stages.pop('draw', 0.0)
+    if stats.link_seconds:
+        stages['raw-data ingest'] = sum(stats.link_seconds.values())
+        if not (options.get('workers') or 1) > 1:
+            stages['rendering'] -= stages['raw-data ingest']
+    # the peak of the scenario process, or of its largest raw-data worker
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    peak_mb = peak / 1e6 if sys.platform == 'darwin' else peak / 1024
+    return {'total_s': total,
+            'stages_s': stages,
+            'peak_rss_mb': peak_mb,
+            'html_bytes': os.path.getsize(os.path.join(out_dir, 'map.html')),
+            'output_bytes': dir_size(out_dir)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def versions():
+    import folium
+    import numpy
+    import pandas
+    return {'python': platform.python_version(),
+            'pandas': pandas.__version__,
+            'numpy': numpy.__version__,
+            'folium': folium.__version__}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--links', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--samples', type=int, default=96 * 7,
+                        help='raw-data samples per link (default: a week of 15 minute data)')
+    parser.add_argument('--files-per-link', type=int, default=1)
+    parser.add_argument('--schemas', nargs='+', default=synthetic.SCHEMAS, choices=synthetic.SCHEMAS)
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--options', type=json.loads, default={},
+                        help='extra Draw_cml_map options as json, e.g. \'{"decimation": "minmax"}\'')
+    parser.add_argument('--out', default='bench_results.json')
+    args = parser.parse_args()
+
+    results = []
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        for num_links in args.links:
+            for schema in args.schemas:
+                data_dir = os.path.join(tmp, '%s_%d' % (schema, num_links))
+                links = synthetic.make_links(num_links, smbit=schema == 'smbit')
+                os.makedirs(data_dir)
+                synthetic.write_metadata(os.path.join(data_dir, 'metadata.csv'), links, schema)
+                if any('rawdata_dir' in MODES[mode] for mode in args.modes):
+                    synthetic.write_rawdata(os.path.join(data_dir, 'rawdata'), links,
+                                            num_samples=args.samples,
+                                            files_per_link=args.files_per_link)
+                for mode in args.modes:
+                    out_dir = os.path.join(tmp, 'out_%s_%d_%s' % (schema, num_links, mode))
+                    # not a multiprocessing.Pool: its processes are daemonic and cannot
+                    # start the raw-data workers of the scenario
+                    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as executor:
+                        result = executor.submit(run_scenario, data_dir, out_dir, mode,
+                                                 args.options).result()
+                    result.update({'schema': schema, 'mode': mode, 'links': num_links,
+                                   'samples': args.samples if 'rawdata_dir' in MODES[mode] else 0})
+                    results.append(result)
+                    print('%-10s %-9s %7d links  %8.2f s  %8.1f MB peak  %8.2f MB html' % (
+                        schema, mode, num_links, result['total_s'], result['peak_rss_mb'],
+                        result['html_bytes'] / 1e6))
+
+    with open(args.out, 'w') as f:
+        json.dump({'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                   'git_commit': git_commit(),
+                   'versions': versions(),
+                   'options': args.options,
+                   'results': results}, f, indent=2)
+    print('Results written to ' + args.out)
+
+
+if __name__ == '__main__':
+    main()
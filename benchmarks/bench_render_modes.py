@@ -0,0 +1,49 @@
+'''Compare the size and build time of maps drawn with one PolyLine per link
+and with a single GeoJSON layer (as_geojson=True), on synthetic metadata.
+
+python benchmarks/bench_render_modes.py --links 1000 5000 20000
+'''
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from draw_cml_map import Draw_cml_map
+import synthetic
+
+
+def run(data_dir, out_dir, name, as_geojson):
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        Draw_cml_map()(out_path=out_dir,
+                       data_path=data_dir,
+                       metadata_file_name='metadata.csv',
+                       name_of_map_file=name,
+                       distort_lat_lon=False,
+                       as_geojson=as_geojson)
+    elapsed = time.perf_counter() - t0
+    size = os.path.getsize(os.path.join(out_dir, name + '.html'))
+    return elapsed, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--links', type=int, nargs='+', default=[1000, 5000, 20000])
+    args = parser.parse_args()
+
+    print('%8s  %-10s  %10s  %12s' % ('links', 'mode', 'time (s)', 'html (MB)'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for num_links in args.links:
+            synthetic.write_metadata(os.path.join(tmp, 'metadata.csv'), synthetic.make_links(num_links))
+            for mode, as_geojson in (('polylines', False), ('geojson', True)):
+                elapsed, size = run(tmp, tmp, 'map_' + mode, as_geojson)
+                print('%8d  %-10s  %10.2f  %12.2f' % (num_links, mode, elapsed, size / 1e6))
+
+
+if __name__ == '__main__':
+    main()
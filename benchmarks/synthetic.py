@@ -0,0 +1,129 @@
+'''Synthetic metadata files and raw-data directories in the formats read by
+Draw_cml_map, for benchmarks:
+
+links = make_links(1000)
+write_metadata('data/metadata.csv', links, schema='omnisol')
+write_rawdata('data/rawdata', links, num_samples=96 * 30)
+
+Use schema='smbit' for SMBIT links (make_links(1000, smbit=True)).
+'''
+import os
+
+import numpy as np
+import pandas as pd
+
+CARRIERS = ['Cellcom', 'PHI', 'Pelephone', 'Ericsson']
+SCHEMAS = ['omnisol', 'underscore', 'smbit']
+
+# filename prefix and rsl column of the csv raw data of each carrier
+CSV_FORMATS = {
+    'cellcom': ('Cellcom_HC_RADIO_SINK_', 'PowerRLTMmin'),
+    'phi': ('PHI_TN_RFInputPower_', 'RFInputPower'),
+    'pelephone': ('Pelephone_TN_RFInputPower_', 'RFInputPower')
+}
+
+
+def make_links(num_links, smbit=False, seed=0):
+    '''DataFrame of num_links links with the standard metadata columns. Links come
+    in pairs, the two directions of a hop between the same two sites.
+    '''
+    rng = np.random.default_rng(seed)
+    num_hops = (num_links + 1) // 2
+    lat_a = rng.uniform(29.5, 33.3, num_hops)
+    lon_a = rng.uniform(34.3, 35.9, num_hops)
+    lat_b = lat_a + rng.normal(0, 0.05, num_hops)
+    lon_b = lon_a + rng.normal(0, 0.05, num_hops)
+    hop = np.arange(num_links) // 2
+    up = np.arange(num_links) % 2 == 0
+    if smbit:
+        link_ids = ['%s%06d' % ('up' if u else 'dn', h) for u, h in zip(up, hop)]
+        carriers = np.full(num_links, 'SMBIT')
+    else:
+        link_ids = ['%06d-%s' % (h, 'A' if u else 'B') for u, h in zip(up, hop)]
+        carriers = np.array(CARRIERS)[rng.integers(0, len(CARRIERS), num_hops)][hop]
+    return pd.DataFrame({
+        'link id': link_ids,
+        'hop id': ['H%06d' % h for h in hop],
+        'link carrier': carriers,
+        'rx site latitude': np.where(up, lat_a[hop], lat_b[hop]),
+        'rx site longitude': np.where(up, lon_a[hop], lon_b[hop]),
+        'tx site latitude': np.where(up, lat_b[hop], lat_a[hop]),
+        'tx site longitude': np.where(up, lon_b[hop], lon_a[hop])
+    })
+
+
+def write_metadata(path, links, schema='omnisol'):
+    '''Write the links as a metadata csv file of the given schema
+    ('omnisol', 'underscore' or 'smbit').
+    '''
+    if schema == 'omnisol':
+        df = links.rename(columns=lambda col: col.title().replace('Id', 'ID'))
+    elif schema == 'underscore':
+        df = links.rename(columns={'link id': 'link_id',
+                                   'hop id': 'hop_id',
+                                   'link carrier': 'carrier',
+                                   'rx site latitude': 'rx_site_latitude',
+                                   'rx site longitude': 'rx_site_longitude',
+                                   'tx site latitude': 'txsite_latitude',
+                                   'tx site longitude': 'txsite_longitude'})
+    elif schema == 'smbit':
+        # one row per hop, its links in up_valid_names/down_valid_names
+        up = links.iloc[::2].reset_index(drop=True)
+        down = links.iloc[1::2].reset_index(drop=True).reindex(range(len(up)))
+        df = pd.DataFrame({
+            'hop_name': up['hop id'],
+            'site1_longitude': up['rx site longitude'],
+            'site1_latitude': up['rx site latitude'],
+            'site2_longitude': up['tx site longitude'],
+            'site2_latitude': up['tx site latitude'],
+            'up_valid_names': 'siklu_' + up['link id'],
+            'down_valid_names': 'siklu_' + down['link id']
+        })
+    else:
+        raise ValueError('Unknown schema ' + str(schema) + ', known schemas: ' + ', '.join(SCHEMAS))
+    df.to_csv(path, index=False)
+
+
+def make_rsl(num_samples, rng):
+    # rsl around a baseline with noise and a few rain dips
+    rsl = rng.uniform(-60, -40) + rng.normal(0, 0.5, num_samples)
+    for start in rng.integers(0, num_samples, max(1, num_samples // 500)):
+        rsl[start:start + 8] -= rng.uniform(5, 30)
+    return np.round(rsl, 1)
+
+
+def write_rawdata(rawdata_dir, links, num_samples=96, files_per_link=1, interval=15,
+                  start='2020-01-01', seed=0):
+    '''Write num_samples rsl samples of every link, split into files_per_link files,
+    named and formatted as the raw data of its carrier.
+    '''
+    rng = np.random.default_rng(seed)
+    os.makedirs(rawdata_dir, exist_ok=True)
+    times = pd.date_range(start, periods=num_samples, freq='%dmin' % interval)
+    chunks = np.array_split(np.arange(num_samples), files_per_link)
+    for link in links.to_dict('records'):
+        rsl = make_rsl(num_samples, rng)
+        carrier = str(link['link carrier']).lower()
+        for k, rows in enumerate(chunks):
+            time = times[rows].strftime('%Y-%m-%d %H:%M:%S')
+            if carrier == 'smbit':
+                clock = (times[rows].values.astype('datetime64[s]').astype(np.int64) - 7200).tolist()
+                records = ["{'itemid': '%d', 'siklu.rssavg': {'lastvalue': '%s', 'lastclock': '%d'}, "
+                           "'clock': datetime(%d, %d, %d, %d, %d)}" %
+                           (i, value, c, t.year, t.month, t.day, t.hour, t.minute)
+                           for i, (value, c, t) in enumerate(zip(rsl[rows], clock, times[rows]))]
+                path = os.path.join(rawdata_dir, 'SMBIT_siklu_%s_%d.txt' % (link['link id'], k))
+                with open(path, 'w') as f:
+                    f.write('[' + ', '.join(records) + ']')
+            elif carrier == 'ericsson':
+                path = os.path.join(rawdata_dir, 'Ericsson_MW_%s_%d.csv' % (link['link id'], k))
+                pd.DataFrame({'time': time,
+                              'link id': link['link id'],
+                              'tsl': 0,
+                              'rsl': rsl[rows]}).to_csv(path, index=False, header=False)
+            else:
+                prefix, rsl_col = CSV_FORMATS[carrier]
+                path = os.path.join(rawdata_dir, '%s%s_%d.csv' % (prefix, link['link id'], k))
+                pd.DataFrame({'Time': time,
+                              'Interval': interval,
+                              rsl_col: rsl[rows]}).to_csv(path, index=False)
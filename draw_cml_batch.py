@@ -0,0 +1,155 @@
+'''Draw many maps of the same metadata and raw data in one run:
+
+python draw_cml_batch.py jobs.yaml --jobs 4 --stats stats.json
+
+The job spec (.yaml, .yml or .json) lists the maps to draw, each as the options of
+a Draw_cml_map call. Options given at the top level apply to all the maps:
+
+data_path: /directory/of/metadata/
+metadata_file_name: metadata.csv
+rawdata_dir: rawdata
+out_path: /directory/of/out/
+rsl_sidecar: true
+maps:
+  - name_of_map_file: north
+    area_min_lat: 32.5
+  - name_of_map_file: cellcom
+    carriers: [cellcom]
+    list_of_link_id_to_color: [TS01-7330]
+  - name_of_map_file: storm
+    start: 2020-01-05
+    end: 2020-01-08
+
+A plain list of maps is accepted too. Every metadata file is read and every raw-data
+directory is indexed once, and the maps are drawn from them by --jobs processes.
+'''
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from draw_cml_map import Draw_cml_map
+
+
+def read_spec(path):
+    # returns the list of maps of the job spec, with the top-level options applied
+    with open(path) as f:
+        if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError('PyYAML is needed for .yaml job specs (pip install pyyaml), '
+                                  'or write the job spec as .json')
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    if isinstance(spec, list):
+        spec = {'maps': spec}
+    defaults = {k: v for k, v in spec.items() if k != 'maps'}
+    maps = [dict(defaults, **options) for options in spec.get('maps', [])]
+    for i, options in enumerate(maps):
+        missing = [k for k in ('out_path', 'data_path', 'metadata_file_name') if k not in options]
+        if missing:
+            raise ValueError('Map ' + str(i) + ' of ' + str(path) + ' has no ' + ', '.join(missing))
+        options.setdefault('name_of_map_file', 'link_map' + str(i + 1))
+    return maps
+
+
+def md_key(options):
+    return str(Path(options['data_path']).joinpath(options['metadata_file_name']))
+
+
+def rd_key(options):
+    if not options.get('rawdata_dir'):
+        return None
+    return str(Path(options['data_path']).joinpath(options['rawdata_dir']))
+
+
+def load_shared(maps):
+    # read every metadata file and index every raw-data directory of the maps once
+    loader = Draw_cml_map()
+    shared = {'md': {}, 'rd': {}}
+    for options in maps:
+        if md_key(options) not in shared['md']:
+            shared['md'][md_key(options)] = loader.load_md(md_key(options))
+        if rd_key(options) and rd_key(options) not in shared['rd']:
+            shared['rd'][rd_key(options)] = loader.index_rd(rd_key(options), options.get('rd_index_file'))
+    return shared
+
+
+def draw_map(options, shared):
+    # draw one map from the shared metadata and raw-data index, returns its stats
+    t0 = time.perf_counter()
+    stats = Draw_cml_map()(df_md=shared['md'][md_key(options)],
+                           rd_index=shared['rd'].get(rd_key(options)),
+                           **options)
+    result = stats.to_dict()
+    result['seconds'] = time.perf_counter() - t0
+    return result
+
+
+def _init_batch_worker(shared):
+    global _shared
+    _shared = shared
+
+def _batch_worker_job(options):
+    return draw_map(options, _shared)
+
+
+def run_batch(maps, jobs=1):
+    '''Draw the maps (list of Draw_cml_map options) with jobs processes. Returns
+    {name_of_map_file: stats dict, or {'error': ...} if the map failed}.'''
+    t0 = time.perf_counter()
+    shared = load_shared(maps)
+    print('Loaded ' + str(len(shared['md'])) + ' metadata files and ' + str(len(shared['rd'])) +
+          ' raw-data indexes in ' + '{:.2f}'.format(time.perf_counter() - t0) + ' s')
+    results = {}
+    if jobs > 1 and len(maps) > 1:
+        with ProcessPoolExecutor(max_workers=jobs,
+                                 initializer=_init_batch_worker,
+                                 initargs=(shared,)) as executor:
+            futures = {executor.submit(_batch_worker_job, options): options['name_of_map_file']
+                       for options in maps}
+            for future in as_completed(futures):
+                results[futures[future]] = _result(futures[future], future.result)
+    else:
+        for options in maps:
+            results[options['name_of_map_file']] = _result(options['name_of_map_file'],
+                                                           lambda: draw_map(options, shared))
+    print(str(len(maps)) + ' maps in ' + '{:.2f}'.format(time.perf_counter() - t0) + ' s')
+    return results
+
+
+def _result(name, get):
+    # the stats of a map, or its error
+    try:
+        result = get()
+    except Exception as e:
+        print('Map ' + name + ' failed: ' + type(e).__name__ + ': ' + str(e))
+        return {'error': type(e).__name__ + ': ' + str(e)}
+    print('Map ' + name + ' drawn in ' + '{:.2f}'.format(result['seconds']) + ' s')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('spec', help='job spec, .yaml or .json')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='number of maps drawn in parallel (default: number of cpus)')
+    parser.add_argument('--stats', help='(optional) .json file to write the stats of every map to')
+    args = parser.parse_args()
+
+    results = run_batch(read_spec(args.spec), jobs=args.jobs)
+    if args.stats:
+        with open(args.stats, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+    if any('error' in result for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
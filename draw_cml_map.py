@@ -4,15 +4,507 @@ import numpy as np
 import math
 from pathlib import Path
 import os
+import sys
 import vincent
+import branca.colormap
 import json
+import csv
+import re
+import hashlib
+import html
+import time
+import zipfile
+import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from branca.element import Element, MacroElement, Template
+try:
+    import resource
+except ImportError:  # not available on Windows, peak memory is not reported
+    resource = None
+
+# raw-data filename prefix of each carrier and the name of its RSL column
+RD_FILE_PREFIXES = {
+    'Cellcom_HC_RADIO_SINK_': 'PowerRLTMmin',
+    'PHI_TN_RFInputPower_': 'RFInputPower',
+    'Pelephone_TN_RFInputPower_': 'RFInputPower',
+    'SMBIT': 'lastvalue',
+    'Ericsson_MW_': 'rsl'
+}
+
+# distort_lat_lon: sites are the same when equal at DEOVERLAP_DECIMALS decimals, and
+# links between the same sites are drawn DEOVERLAP_SPACING degrees apart
+DEOVERLAP_DECIMALS = 4
+DEOVERLAP_SPACING = 0.0002
+
+# bump when the layout of the raw-data index (rd_index_file) changes
+RD_INDEX_VERSION = 2
+
+# bump when the popups drawn from raw data change, to invalidate render caches
+RENDER_CACHE_VERSION = 1
+
+# SMBIT raw data: the rsl dict of a record and its fields, and the size of the
+# chunks the files are read in
+SMBIT_RSSAVG_RE = re.compile(r"""['"]siklu\.rssavg['"]\s*:\s*\{([^{}]*)\}""")
+SMBIT_FIELD_RE = re.compile(r"""['"](lastvalue|lastclock)['"]\s*:\s*['"]?([^'",}\s]*)""")
+SMBIT_CHUNK_SIZE = 1 << 20
+
+# number of bytes read from the start and the end of a raw file to find the times of
+# its first and last records, for skipping files outside of start/end
+RD_PEEK_SIZE = 1 << 14
+
+RD_AGGREGATIONS = ('min', 'mean', 'max', 'availability')
+
+# memory_budget_mb: approximate memory of a csv row parsed by pandas and of a sample kept
+# in memory (with the copies made while charting it), and the number of partial aggregates
+# of a link combined at a time. A quarter of the budget goes to the chunks being parsed and
+# a quarter to the samples of a link.
+STREAM_ROW_BYTES = 400
+STREAM_SAMPLE_BYTES = 64
+STREAM_MAX_PARTIALS = 64
+# link ids of each skip reason kept in the stats of streaming mode (counts are complete)
+STREAM_MAX_SKIPPED_IDS = 1000
+
+# metadata file formats, tried in order on the (lowercased) csv header:
+# columns maps {csv column: standard column}, a format is detected when its csv
+# columns cover all the required standard columns, and process (optional) is a
+# method name or a callable applied to the renamed DataFrame.
+MD_SCHEMAS = {
+    'omnisol': {
+        'columns': {'link id': 'link id',
+                    'hop id': 'hop id',
+                    'link carrier': 'link carrier',
+                    'tx site longitude': 'tx site longitude',
+                    'tx site latitude': 'tx site latitude',
+                    'rx site longitude': 'rx site longitude',
+                    'rx site latitude': 'rx site latitude'},
+        'required': ['link id']
+    },
+    'underscore': {
+        'columns': {'link_id': 'link id',
+                    'hop_id': 'hop id',
+                    'carrier': 'link carrier',
+                    'txsite_longitude': 'tx site longitude',
+                    'txsite_latitude': 'tx site latitude',
+                    'rxsite_longitude': 'rx site longitude',
+                    'rxsite_latitude': 'rx site latitude',
+                    'tx_site_longitude': 'tx site longitude',
+                    'tx_site_latitude': 'tx site latitude',
+                    'rx_site_longitude': 'rx site longitude',
+                    'rx_site_latitude': 'rx site latitude'},
+        'required': ['link id']
+    },
+    'smbit': {
+        'columns': {'link carrier': 'link carrier',
+                    'hop_name': 'hop_name',
+                    'site1_longitude': 'site1_longitude',
+                    'site1_latitude': 'site1_latitude',
+                    'site2_longitude': 'site2_longitude',
+                    'site2_latitude': 'site2_latitude',
+                    'up_valid_names': 'up_valid_names',
+                    'down_valid_names': 'down_valid_names'},
+        'required': ['hop_name', 'site1_longitude', 'site1_latitude',
+                     'site2_longitude', 'site2_latitude',
+                     'up_valid_names', 'down_valid_names'],
+        'process': '_process_smbit_md'
+    }
+}
+
+# dtypes the metadata columns are parsed with (by standard column name)
+MD_DTYPES = {
+    'link id': str,
+    'hop id': 'category',
+    'link carrier': 'category',
+    'tx site longitude': np.float32,
+    'tx site latitude': np.float32,
+    'rx site longitude': np.float32,
+    'rx site latitude': np.float32,
+    'hop_name': 'category',
+    'site1_longitude': np.float32,
+    'site1_latitude': np.float32,
+    'site2_longitude': np.float32,
+    'site2_latitude': np.float32,
+    'up_valid_names': str,
+    'down_valid_names': str
+}
+
+def register_md_schema(name, columns, required=('link id',), process=None):
+    '''Register a new metadata file format. It is tried before the existing ones.
+    name: str, name of the format. Registering an existing name replaces it.
+    columns: dict, {csv column name: standard column name}, e.g. {'lat_a': 'tx site latitude'}.
+    Csv column names are matched case insensitively.
+    required: standard column names the csv header must cover to detect the format.
+    process: (optional) callable applied to the renamed DataFrame, returning the
+    DataFrame with the standard columns.
+    '''
+    schemas = [(k, v) for k, v in MD_SCHEMAS.items() if k != name]
+    MD_SCHEMAS.clear()
+    MD_SCHEMAS[name] = {'columns': {k.lower(): v for k, v in columns.items()},
+                        'required': list(required),
+                        'process': process}
+    MD_SCHEMAS.update(schemas)
+
+def lttb_indices(x, y, n_out):
+    '''Indices of the n_out points kept by largest-triangle-three-buckets downsampling
+    of the series (x, y). The first and last points are always kept.
+    '''
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0] = 0
+    idx[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) -
+                      (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + np.argmax(area)
+        idx[i + 1] = a
+    return idx
+
+def minmax_indices(y, n_out, x=None):
+    '''Indices of the minimum and maximum of y in each of n_out // 2 equal buckets
+    (of samples, or of the span of x if given, x in increasing order), in order
+    (at most n_out points).
+    '''
+    n = len(y)
+    n_buckets = n_out // 2
+    if n_out >= n or n_buckets < 1:
+        return np.arange(n)
+    if x is None:
+        bucket = np.arange(n) * n_buckets // n
+    else:
+        span = float(x[-1] - x[0]) or 1.0
+        bucket = np.minimum(((x - x[0]) / span * n_buckets).astype(np.int64), n_buckets - 1)
+    order = np.lexsort((y, bucket))
+    starts = np.searchsorted(bucket[order], np.arange(n_buckets))
+    ends = np.append(starts[1:], n) - 1
+    return np.unique(np.concatenate((order[starts], order[ends])))
+
+class LinkSpatialIndex():
+    '''Grid index of link segments, for bounding-box and radius queries:
+    df: DataFrame of links with the tx/rx site longitude/latitude columns.
+    cell_size: float, size of the (square) grid cells in degrees.
+    '''
+    def __init__(self, df, cell_size=0.1):
+        self.df = df.reset_index(drop=True)
+        self.cell_size = cell_size
+        self.lon0 = self.df['tx site longitude'].values.astype(np.float64)
+        self.lat0 = self.df['tx site latitude'].values.astype(np.float64)
+        self.lon1 = self.df['rx site longitude'].values.astype(np.float64)
+        self.lat1 = self.df['rx site latitude'].values.astype(np.float64)
+        # the cells overlapped by the bounding box of each link
+        ix0 = np.floor(np.minimum(self.lon0, self.lon1) / cell_size).astype(np.int64)
+        ix1 = np.floor(np.maximum(self.lon0, self.lon1) / cell_size).astype(np.int64)
+        iy0 = np.floor(np.minimum(self.lat0, self.lat1) / cell_size).astype(np.int64)
+        iy1 = np.floor(np.maximum(self.lat0, self.lat1) / cell_size).astype(np.int64)
+        nx = ix1 - ix0 + 1
+        n_cells = nx * (iy1 - iy0 + 1)
+        link = np.repeat(np.arange(len(self.df)), n_cells)
+        offset = np.arange(len(link)) - np.repeat(np.cumsum(n_cells) - n_cells, n_cells)
+        self.cells = self._group(ix0[link] + offset % nx[link],
+                                 iy0[link] + offset // nx[link],
+                                 link)
+
+    def _group(self, ix, iy, rows):
+        # {(ix, iy): rows} of the cells
+        if not len(rows):
+            return {}
+        order = np.lexsort((iy, ix))
+        ix, iy, rows = ix[order], iy[order], rows[order]
+        starts = np.flatnonzero(np.r_[True, (np.diff(ix) != 0) | (np.diff(iy) != 0)])
+        return {(int(ix[i]), int(iy[i])): group
+                for i, group in zip(starts, np.split(rows, starts[1:]))}
+
+    def _candidates(self, min_lon, min_lat, max_lon, max_lat):
+        # rows of the links in the cells overlapping the box
+        ix = range(int(np.floor(min_lon / self.cell_size)), int(np.floor(max_lon / self.cell_size)) + 1)
+        iy = range(int(np.floor(min_lat / self.cell_size)), int(np.floor(max_lat / self.cell_size)) + 1)
+        if len(ix) * len(iy) > len(self.cells):
+            groups = [rows for (x, y), rows in self.cells.items() if x in ix and y in iy]
+        else:
+            groups = [self.cells[(x, y)] for x in ix for y in iy if (x, y) in self.cells]
+        if not groups:
+            return np.array([], dtype=np.int64)
+        return np.unique(np.concatenate(groups))
+
+    def query_bbox(self, min_lon, min_lat, max_lon, max_lat):
+        '''Returns the links (rows of df) crossing the box.'''
+        rows = self._candidates(min_lon, min_lat, max_lon, max_lat)
+        x0, y0 = self.lon0[rows], self.lat0[rows]
+        dx, dy = self.lon1[rows] - x0, self.lat1[rows] - y0
+        # Liang-Barsky clipping of the segments to the box
+        t_in = np.zeros(len(rows))
+        t_out = np.ones(len(rows))
+        inside = np.ones(len(rows), dtype=bool)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for p, q in ((-dx, x0 - min_lon), (dx, max_lon - x0),
+                         (-dy, y0 - min_lat), (dy, max_lat - y0)):
+                inside &= ~((p == 0) & (q < 0))
+                t = q / p
+                t_in = np.where(p < 0, np.maximum(t_in, t), t_in)
+                t_out = np.where(p > 0, np.minimum(t_out, t), t_out)
+        return self.df.iloc[rows[inside & (t_in <= t_out)]]
+
+    def query_radius(self, lon, lat, radius_km):
+        '''Returns the links (rows of df) passing within radius_km of the point.'''
+        km_lat = 111.32
+        km_lon = km_lat * np.cos(np.radians(lat))
+        rows = self._candidates(lon - radius_km / km_lon, lat - radius_km / km_lat,
+                                lon + radius_km / km_lon, lat + radius_km / km_lat)
+        # distance of the point to the segments, on a local flat projection
+        x0, y0 = (self.lon0[rows] - lon) * km_lon, (self.lat0[rows] - lat) * km_lat
+        x1, y1 = (self.lon1[rows] - lon) * km_lon, (self.lat1[rows] - lat) * km_lat
+        dx, dy = x1 - x0, y1 - y0
+        length2 = dx ** 2 + dy ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.clip(np.where(length2 > 0, -(x0 * dx + y0 * dy) / length2, 0), 0, 1)
+        dist = np.hypot(x0 + t * dx, y0 + t * dy)
+        return self.df.iloc[rows[dist <= radius_km]]
+
+    def tiles(self):
+        '''Returns {(ix, iy): rows of df} of the links by the cell of their midpoint.'''
+        ix = np.floor((self.lon0 + self.lon1) / 2 / self.cell_size).astype(np.int64)
+        iy = np.floor((self.lat0 + self.lat1) / 2 / self.cell_size).astype(np.int64)
+        return self._group(ix, iy, np.arange(len(self.df)))
+
+class RslSidecarLoader(MacroElement):
+    '''Loads the raw-data timeseries of a link from its sidecar .js file when its
+    popup is opened and draws it as an svg chart. Sidecar files are loaded with
+    <script> tags (not fetch) so that maps opened from the local disk work too.
+    '''
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+        window.cml_rsl = window.cml_rsl || {};
+        window.cml_rsl_draw = function(key) {
+            var div = document.querySelector('.cml-rsl[data-key="' + key + '"]');
+            var d = window.cml_rsl[key];
+            if (!div || !d) { return; }
+            var date = function(s) { return new Date(s * 1000).toISOString().slice(0, 16).replace('T', ' '); };
+            var esc = function(s) { return String(s).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;'); };
+            var w = 750, h = 350, l = 50, r = 15, t = 40, b = 45;
+            var n = d.t.length, t0 = d.t[0], t1 = d.t[n - 1];
+            var series = d.series || {rsl: d.rsl}, names = Object.keys(series);
+            var colors = ['steelblue', 'darkorange', 'seagreen', 'crimson'];
+            var y0 = Infinity, y1 = -Infinity;
+            names.forEach(function(name) {
+                for (var i = 0; i < n; i++) {
+                    var v = series[name][i];
+                    if (v === null) { continue; }
+                    if (v < y0) { y0 = v; }
+                    if (v > y1) { y1 = v; }
+                }
+            });
+            var dt = (t1 - t0) || 1, dy = (y1 - y0) || 1;
+            var lines = names.map(function(name, k) {
+                var pts = [];
+                for (var i = 0; i < n; i++) {
+                    if (series[name][i] === null) { continue; }
+                    pts.push((l + (d.t[i] - t0) / dt * (w - l - r)).toFixed(1) + ',' +
+                             (h - b - (series[name][i] - y0) / dy * (h - t - b)).toFixed(1));
+                }
+                var legend = d.series ? '<text x="' + (w - r) + '" y="' + (t - 4 - 12 * (names.length - 1 - k)) +
+                    '" text-anchor="end" fill="' + colors[k % 4] + '">' + esc(name) + '</text>' : '';
+                return legend + '<polyline fill="none" stroke="' + colors[k % 4] + '" stroke-width="1" points="' + pts.join(' ') + '"/>';
+            });
+            div.innerHTML = '<svg width="' + w + '" height="' + h + '" font-family="sans-serif" font-size="11">' +
+                '<text x="' + l + '" y="14" font-weight="bold">' + esc(div.dataset.title) + '</text>' +
+                '<line x1="' + l + '" y1="' + t + '" x2="' + l + '" y2="' + (h - b) + '" stroke="black"/>' +
+                '<line x1="' + l + '" y1="' + (h - b) + '" x2="' + (w - r) + '" y2="' + (h - b) + '" stroke="black"/>' +
+                '<text x="' + (l - 4) + '" y="' + (t + 4) + '" text-anchor="end">' + y1 + '</text>' +
+                '<text x="' + (l - 4) + '" y="' + (h - b) + '" text-anchor="end">' + y0 + '</text>' +
+                '<text x="' + l + '" y="' + (h - b + 15) + '">' + date(t0) + '</text>' +
+                '<text x="' + (w - r) + '" y="' + (h - b + 15) + '" text-anchor="end">' + date(t1) + '</text>' +
+                '<text x="' + ((w + l) / 2) + '" y="' + (h - 8) + '" text-anchor="middle">' + esc(div.dataset.xtitle) + '</text>' +
+                '<text x="12" y="' + ((h - b + t) / 2) + '" text-anchor="middle" transform="rotate(-90 12 ' + ((h - b + t) / 2) + ')">' + esc(div.dataset.ytitle || 'RSL (dB)') + '</text>' +
+                lines.join('') + '</svg>';
+        };
+        window.cml_rsl_loaded = function(key, data) {
+            window.cml_rsl[key] = data;
+            window.cml_rsl_draw(key);
+        };
+        {{ this._parent.get_name() }}.on('popupopen', function(e) {
+            var div = e.popup.getElement().querySelector('.cml-rsl');
+            if (!div) { return; }
+            var key = div.dataset.key;
+            if (window.cml_rsl[key]) { window.cml_rsl_draw(key); return; }
+            if (div.dataset.loading) { return; }
+            div.dataset.loading = '1';
+            var s = document.createElement('script');
+            s.src = div.dataset.src;
+            document.body.appendChild(s);
+        });
+        {% endmacro %}
+        """)
+
+    def __init__(self):
+        super(RslSidecarLoader, self).__init__()
+        self._name = 'RslSidecarLoader'
+
+class RunStats():
+    '''Timings and counts of a call of Draw_cml_map (returned by the call and kept in
+    its stats attribute):
+    stages: {stage: {'seconds', 'peak_rss_growth_mb', 'peak_rss_mb'}}, wall time of each stage,
+    how much the stage raised the peak memory of the process and the peak memory of the
+    process so far at its end (cumulative, not of the stage alone). Memory is None where
+    not available.
+    files: {carrier prefix: {'indexed', 'parsed', 'bytes', 'pruned'}}, raw files found, raw
+    files parsed and their size (files read from rd_cache_dir are not parsed again), and raw
+    files not read since they are outside of start/end.
+    link_seconds: {link id: seconds}, time spent reading and charting the raw data of each link.
+    skipped: {reason: [link ids]}, links that are not drawn.
+    failed: {link id: [errors]}, raw data that could not be read or charted.
+    skip_counts: {reason: number of links}.
+    callback: (optional) function called as callback(event, data) on every record, event
+    being 'stage', 'link', 'skip' or 'fail' and data a dict.
+    max_skipped_ids: int, (optional) number of link ids kept in skipped per reason, all by default.
+    '''
+    def __init__(self, callback=None, max_skipped_ids=None):
+        self.callback = callback
+        self.max_skipped_ids = max_skipped_ids
+        self.stages = {}
+        self.files = {}
+        self.link_seconds = {}
+        self.skipped = {}
+        self.skip_counts = {}
+        self.failed = {}
+
+    def _emit(self, event, data):
+        if self.callback:
+            self.callback(event, data)
+
+    def stage(self, name):
+        '''Context manager timing a stage (times of stages with the same name add up).'''
+        return _StageTimer(self, name)
+
+    def add_stage(self, name, seconds, peak_rss_growth_mb=None):
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'peak_rss_growth_mb': None,
+                                              'peak_rss_mb': None})
+        stage['seconds'] += seconds
+        if peak_rss_growth_mb is not None:
+            stage['peak_rss_growth_mb'] = round((stage['peak_rss_growth_mb'] or 0.0) + peak_rss_growth_mb, 1)
+        stage['peak_rss_mb'] = peak_rss_mb()
+        self._emit('stage', dict(stage, stage=name))
+
+    def _files(self, prefix):
+        return self.files.setdefault(prefix, {'indexed': 0, 'parsed': 0, 'bytes': 0, 'pruned': 0})
+
+    def add_indexed(self, prefix, count):
+        self._files(prefix)['indexed'] += count
+
+    def add_pruned(self, prefix):
+        self._files(prefix)['pruned'] += 1
+
+    def add_file(self, prefix, nbytes):
+        files = self._files(prefix)
+        files['parsed'] += 1
+        files['bytes'] += nbytes
+
+    def add_link(self, link_id, seconds):
+        self.link_seconds[link_id] = self.link_seconds.get(link_id, 0.0) + seconds
+        self._emit('link', {'link id': link_id, 'seconds': seconds})
+
+    def skip(self, reason, link_ids):
+        link_ids = list(link_ids)
+        if link_ids:
+            skipped = self.skipped.setdefault(reason, [])
+            if self.max_skipped_ids is None:
+                skipped.extend(link_ids)
+            else:
+                skipped.extend(link_ids[:max(0, self.max_skipped_ids - len(skipped))])
+            self.skip_counts[reason] = self.skip_counts.get(reason, 0) + len(link_ids)
+            self._emit('skip', {'reason': reason, 'link ids': link_ids})
+
+    def fail(self, link_id, error):
+        self.failed.setdefault(link_id, []).append(error)
+        self._emit('fail', {'link id': link_id, 'error': error})
+
+    def merge(self, other):
+        '''Add the file, link and failure records of other (e.g. from a worker process).'''
+        for prefix, files in other.files.items():
+            mine = self._files(prefix)
+            mine['parsed'] += files['parsed']
+            mine['bytes'] += files['bytes']
+            mine['pruned'] += files['pruned']
+        for link_id, seconds in other.link_seconds.items():
+            self.add_link(link_id, seconds)
+        for link_id, errors in other.failed.items():
+            for error in errors:
+                self.fail(link_id, error)
+
+    def to_dict(self):
+        return {'stages': self.stages,
+                'files': self.files,
+                'links ingested': len(self.link_seconds),
+                'ingest seconds': sum(self.link_seconds.values()),
+                'link seconds': self.link_seconds,
+                'skipped': self.skip_counts,
+                'skipped links': self.skipped,
+                'failed': self.failed}
+
+    def to_json(self, path=None):
+        '''Returns the stats as json, also written to path if given.'''
+        text = json.dumps(self.to_dict(), indent=2, default=str)
+        if path:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def log(self, logger=None, level=logging.INFO):
+        '''Log a summary of the stats (by default to the draw_cml_map logger).'''
+        logger = logger or logging.getLogger(__name__)
+        for name, stage in self.stages.items():
+            logger.log(level, 'stage %s: %.3f s, peak rss +%s MB (%s MB so far)', name, stage['seconds'],
+                       stage['peak_rss_growth_mb'], stage['peak_rss_mb'])
+        for prefix, files in self.files.items():
+            logger.log(level, 'raw files %s: %d indexed, %d parsed (%d bytes), %d outside of start/end',
+                       prefix, files['indexed'], files['parsed'], files['bytes'], files['pruned'])
+        if self.link_seconds:
+            logger.log(level, 'raw data of %d links ingested in %.3f s',
+                       len(self.link_seconds), sum(self.link_seconds.values()))
+        for reason, count in self.skip_counts.items():
+            logger.log(level, '%d links skipped: %s', count, reason)
+        for link_id, errors in self.failed.items():
+            logger.log(max(level, logging.WARNING), 'raw data of link %s failed: %s', link_id, '; '.join(errors))
+
+class _StageTimer():
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.peak0 = peak_rss_mb()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.t0
+        peak = peak_rss_mb()
+        self.stats.add_stage(self.name, seconds, peak - self.peak0 if peak is not None else None)
+        return False
+
+def peak_rss_mb():
+    '''Peak resident memory of the process in MB, None where not available.'''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return round(peak / 1e6 if sys.platform == 'darwin' else peak / 1024, 1)
 
 class Draw_cml_map():
     def __init__(self):
-        self.map_1 = folium.Map(location=[32, 35],
-                           zoom_start=8,
-                           tiles='Stamen Terrain',
-                           control_scale=True)
+        self.map_1 = self._new_map()
+
+    def _new_map(self):
+        return folium.Map(location=[32, 35],
+                          zoom_start=8,
+                          tiles='Stamen Terrain',
+                          control_scale=True)
     def __call__(self,
                  out_path,
                  data_path,
@@ -29,7 +521,25 @@ class Draw_cml_map():
                  list_of_link_id_to_color=[],
                  color_of_specific_links='red',
                  color_of_links=None,
-                 distort_lat_lon=True
+                 distort_lat_lon=True,
+                 rd_index_file=None,
+                 as_geojson=False,
+                 rsl_sidecar=False,
+                 workers=None,
+                 rd_cache_dir=None,
+                 decimation=None,
+                 max_points=1500,
+                 render_cache_dir=None,
+                 tile_size=None,
+                 stats_callback=None,
+                 carriers=None,
+                 start=None,
+                 end=None,
+                 df_md=None,
+                 rd_index=None,
+                 resample=None,
+                 aggregation=('min', 'mean', 'max'),
+                 memory_budget_mb=None
             ):
         '''Create a Folium interactive map of lines (cmls):
         out_path: str, path to output (created automatically if not provided).
@@ -44,7 +554,54 @@ class Draw_cml_map():
         list_of_link_id_to_drop: list of strings, links you wish to discard .
         list_of_link_id_to_color: color specific links in different colors.
         color_of_links: str, color of links from a given csv file
-        distort_lat_lon: Distort the coordinates to see links on the same hop when zoomed in.
+        distort_lat_lon: Shift links drawn between the same two sites to parallel lines, to see
+        links on the same hop when zoomed in. The shifts are the same on every run.
+        rd_index_file: str, (optional) .json file to save the raw-data file index to.
+        If the raw-data directory has not changed since it was saved, the index is
+        loaded from it instead of scanning the directory again.
+        as_geojson: bool, draw the links (without raw data) as a single GeoJSON layer
+        instead of one PolyLine per link. Recommended for large numbers of links.
+        rsl_sidecar: bool, write the raw-data timeseries of each link to a small .js file
+        in the folder <name_of_map_file>_rsl next to the html, and load it only when the
+        popup of the link is opened instead of embedding all charts in the html.
+        Keep the folder next to the html when moving it.
+        workers: int, (optional) number of processes reading and preparing the raw data
+        of the links in parallel. By default the links are processed one by one.
+        rd_cache_dir: str, (optional) directory of a binary cache of the raw data, one .npz
+        file per link. Raw files are parsed once, and again only when they are new or changed.
+        decimation: str, (optional) downsampling of the raw-data timeseries before they are
+        charted: 'lttb' (largest triangle three buckets) or 'minmax' (the minimum and maximum of
+        each time bucket, keeps every dip of the rsl). By default all samples are charted.
+        max_points: int, maximal number of points charted per link when decimation is set.
+        render_cache_dir: str, (optional) directory where the popups of each link are kept
+        with a fingerprint of its metadata, raw files and the call options. On the next call
+        only the links that changed are processed again.
+        tile_size: float, (optional) split the map into square tiles of tile_size degrees.
+        The links of each tile are drawn on a sub-map of their own (<name_of_map_file>_tile_<x>_<y>.html)
+        and the map itself shows the number of links per tile, linking to the sub-maps.
+        The spatial index of the links is kept in self.spatial_index (see LinkSpatialIndex).
+        stats_callback: (optional) function called as stats_callback(event, data) while the map
+        is drawn, see RunStats. The stats of the call (stage times and memory, raw files parsed,
+        ingest time per link, skipped and failed links) are returned and kept in self.stats.
+        carriers: list of strings, (optional) draw only the links of these carriers.
+        start, end: str or datetime, (optional) chart only the raw data from start and
+        before end (excluded). Raw files whose first and last records are outside of the window
+        are not read at all (raw files are expected to be in time order).
+        resample: str, (optional) pandas frequency, e.g. '1H' or '1D'. The raw data is charted
+        as the aggregation of each period instead of sample by sample (decimation is then not used).
+        aggregation: list of strings, what is charted for each resample period, of 'min', 'mean', 'max'
+        (rsl) and 'availability' (fraction of the expected samples, by interval, that were measured).
+        With 'availability' the availability of the link over the whole chart is added to its title.
+        memory_budget_mb: float, (optional) streaming mode for large inputs: the metadata is read in
+        chunks of rows, keeping only the links to draw of each chunk, and the raw files of a link are
+        read in chunks reduced on the fly (to the aggregates of each period with resample), so that the
+        memory used stays within about memory_budget_mb per process. Links with more samples than fit
+        in the budget are decimated (minmax unless decimation is 'lttb'). Cannot be used with
+        rd_cache_dir. Use rsl_sidecar or decimation too, so that the map itself stays small.
+        df_md: DataFrame, (optional) metadata already loaded with load_md, used instead of
+        reading metadata_file_name again (e.g. when drawing many maps of the same links).
+        rd_index: dict, (optional) raw-data file index already built with index_rd, used
+        instead of scanning rawdata_dir again.
 
         The object can be called multiple times so that more information can be added onto it.
         '''
@@ -65,6 +622,29 @@ class Draw_cml_map():
         self.color_of_specific_links = color_of_specific_links
         self.color_of_links = color_of_links
         self.distort_lat_lon = distort_lat_lon
+        self.rd_index_file = rd_index_file
+        self.as_geojson = as_geojson
+        self.rsl_sidecar = rsl_sidecar
+        self.workers = workers
+        self.rd_cache_dir = rd_cache_dir
+        self.decimation = decimation
+        self.max_points = max_points
+        self.render_cache_dir = render_cache_dir
+        self.tile_size = tile_size
+        self.carriers = carriers
+        self.start = start
+        self.end = end
+        self.resample = resample
+        self.aggregation = list(aggregation)
+        self.memory_budget_mb = memory_budget_mb
+        self.stats = RunStats(stats_callback,
+                              max_skipped_ids=STREAM_MAX_SKIPPED_IDS if memory_budget_mb else None)
+        if self.decimation not in (None, 'lttb', 'minmax'):
+            raise ValueError("decimation must be None, 'lttb' or 'minmax'")
+        if not self.aggregation or not set(self.aggregation).issubset(RD_AGGREGATIONS):
+            raise ValueError('aggregation must be a list of ' + ', '.join(RD_AGGREGATIONS))
+        if self.memory_budget_mb and self.rd_cache_dir:
+            raise ValueError('memory_budget_mb cannot be used with rd_cache_dir')
     
         if not os.path.exists(self.out_path):
             os.makedirs(self.out_path)
@@ -74,77 +654,50 @@ class Draw_cml_map():
         meta_path = self.data_path.joinpath(self.metadata_file_name)
         if self.rawdata_dir:
             self.rawdata_path = self.data_path.joinpath(self.rawdata_dir)
+            if rd_index is None:
+                with self.stats.stage('raw-data index'):
+                    rd_index = self._get_rd_index()
+            self.rd_index = rd_index
+            for str_in_filename, files in self.rd_index.items():
+                self.stats.add_indexed(str_in_filename, len({f for fs in files.values() for f in fs}))
         
-        df_md = pd.read_csv(meta_path)
-        df_md.columns = df_md.columns.str.lower()
-        if 'link id' not in df_md.columns:
-            if 'link_id' in df_md.columns:
-                try:
-                    df_md.rename(columns={'hop_id': 'hop id'}, inplace=True)
-                except:
-                    pass
-                try:
-                    df_md.rename(columns={'link_id':'link id'}, inplace=True)
-                except:
-                    pass
-                try:
-                    df_md.rename(columns={'txsite_longitude':'tx site longitude'}, inplace=True)
-                except:
-                    pass
-                try:
-                    df_md.rename(columns={'txsite_latitude': 'tx site latitude'}, inplace=True)
-                except:
-                    pass
-                try:
-                    df_md.rename(columns={'rxsite_longitude': 'rx site longitude'}, inplace=True)
-                except:
-                    pass
-                try:
-                    df_md.rename(columns={'rxsite_latitude': 'rx site latitude'}, inplace=True)
-                except:
-                    pass
-                try:
-                    df_md.rename(columns={'carrier': 'link carrier'}, inplace=True)
-                except:
-                    pass
-                try:
-                    df_md.rename(columns={'tx_site_longitude':'tx site longitude'}, inplace=True)
-                except:
-                    pass
-                try:
-                    df_md.rename(columns={'tx_site_latitude': 'tx site latitude'}, inplace=True)
-                except:
-                    pass
-                try:
-                    df_md.rename(columns={'rx_site_longitude': 'rx site longitude'}, inplace=True)
-                except:
-                    pass
-                try:
-                    df_md.rename(columns={'rx_site_latitude': 'rx site latitude'}, inplace=True)
-                except:
-                    pass
-                #     df_md.rename(columns={'hop_id':'hop id',
-                #                           'link_id':'link id',
-                #                           'txsite_longitude':'tx site longitude',
-                #                           'txsite_latitude': 'tx site latitude',
-                #                           'rxsite_longitude': 'rx site longitude',
-                #                           'rxsite_latitude': 'rx site latitude',
-                #                           'carrier': 'link carrier'},
-                #                  inplace=True)
-                # except:
-                #     pass
-            else:
-                df_md = self._process_smbit_md(df_md)
-        if 'hop id' not in df_md.columns.values:
-            hop_id = 'not provided'
-            df_md['hop id'] = hop_id
-        if 'link carrier' not in df_md.columns.values:
-            carrier = 'unknown carrier'
-            df_md['link carrier'] = carrier
-        df_md['link carrier'] = df_md['link carrier'].str.lower()
+        if df_md is None:
+            with self.stats.stage('metadata load'):
+                if self.memory_budget_mb:
+                    df_md = self._stream_md(meta_path)
+                else:
+                    df_md = self._load_md(meta_path)
         carriers = df_md['link carrier'].unique()
         print('carriers:')
         print(carriers)
+        with self.stats.stage('filtering'):
+            df_md, df_links, num_cmls_map = self._select_links(df_md)
+
+        with self.stats.stage('draw'):
+            if self.tile_size:
+                self.spatial_index = LinkSpatialIndex(df_links, cell_size=self.tile_size)
+                self._draw_tiles()
+            else:
+                self._draw_links(df_links)
+    
+        print('Number of links in map: ')
+        print(num_cmls_map)
+        print(str(self.out_path.joinpath(self.name_of_map_file)))
+    
+        # plot gridlines
+        if self.num_of_gridlines:
+            with self.stats.stage('gridlines'):
+                self._draw_gridlines(df_md)
+    
+        with self.stats.stage('save'):
+            self._save_map(str(self.out_path.joinpath(self.name_of_map_file)))
+    
+        print('Map under the name ' + self.name_of_map_file + ' was generated.')
+        return self.stats
+
+    def _select_links(self, df_md):
+        # returns the metadata in the area of interest, the links to draw (with their
+        # colors) and their number
         d_colors = {
             'cellcom': 'purple',
             'pelephone': 'blue',
@@ -163,8 +716,11 @@ class Draw_cml_map():
                 'unknown carrier': self.color_of_links
             }
     
-        df_md.drop_duplicates(subset='link id', inplace=True)
+        duplicated = df_md['link id'].duplicated()
+        self.stats.skip('duplicate link id', df_md.loc[duplicated, 'link id'])
+        df_md = df_md[~duplicated]
         df_bool = df_md['rx site longitude'].astype(bool)
+        self.stats.skip('zero longitude', df_md.loc[~df_bool, 'link id'])
         df_md = df_md[df_bool]
         df_md.reset_index(inplace=True, drop=True)
     
@@ -181,264 +737,1024 @@ class Draw_cml_map():
             self.area_max_lat = np.nanmax((np.nanmax(df_md['tx site latitude'].values),
                             np.nanmax(df_md['rx site latitude'].values)))
     
-        try:
-            df_md = df_md[df_md['rx site longitude'] < self.area_max_lon]
-            df_md = df_md[df_md['tx site longitude'] < self.area_max_lon]
-        except:
-            pass
-        try:
-            df_md = df_md[df_md['rx site longitude'] > self.area_min_lon]
-            df_md = df_md[df_md['tx site longitude'] > self.area_min_lon]
-        except:
-            pass
-        try:
-            df_md = df_md[df_md['rx site latitude'] < self.area_max_lat]
-            df_md = df_md[df_md['tx site latitude'] < self.area_max_lat]
-        except:
-            pass
-        try:
-            df_md = df_md[df_md['rx site latitude'] > self.area_min_lat]
-            df_md = df_md[df_md['tx site latitude'] > self.area_min_lat]
-        except:
-            pass
+        in_area = ((df_md['rx site longitude'] < self.area_max_lon) &
+                   (df_md['tx site longitude'] < self.area_max_lon) &
+                   (df_md['rx site longitude'] > self.area_min_lon) &
+                   (df_md['tx site longitude'] > self.area_min_lon) &
+                   (df_md['rx site latitude'] < self.area_max_lat) &
+                   (df_md['tx site latitude'] < self.area_max_lat) &
+                   (df_md['rx site latitude'] > self.area_min_lat) &
+                   (df_md['tx site latitude'] > self.area_min_lat))
+        self.stats.skip('out of area', df_md.loc[~in_area, 'link id'])
+        df_md = df_md[in_area]
 
-        if self.distort_lat_lon:
-            df_md['distort rx site longitude'] = np.random.randint(-5, 5, df_md.shape[0]) / 10000
-            df_md['distort tx site longitude'] = np.random.randint(-5, 5, df_md.shape[0]) / 10000
-            df_md['distort rx site latitude'] = np.random.randint(-5, 5, df_md.shape[0]) / 10000
-            df_md['distort tx site latitude'] = np.random.randint(-5, 5, df_md.shape[0]) / 10000
-    
-            df_md['rx site longitude'] = df_md['rx site longitude'] + df_md['distort rx site longitude']
-            df_md['tx site longitude'] = df_md['tx site longitude'] + df_md['distort tx site longitude']
-            df_md['rx site latitude'] = df_md['rx site latitude'] + df_md['distort rx site latitude']
-            df_md['tx site latitude'] = df_md['tx site latitude'] + df_md['distort tx site latitude']
-    
         df_md.reset_index(inplace=True,drop=True)
         num_cmls_map = len(df_md['link id'])
-    
-        grid = []
-    
-        for i,link in df_md.iterrows():
-            link_id = link['link id']
-            hop_id = link['hop id']
-            # color = self.color_of_links
-            self.color = d_colors[link['link carrier']]
-            if link_id in self.list_of_link_id_to_drop:
+
+        # select the links to draw and their colors
+        to_drop = df_md['link id'].isin(set(self.list_of_link_id_to_drop))
+        no_md = ~to_drop & df_md['rx site latitude'].isna()
+        for link_id, dropped in zip(df_md.loc[to_drop | no_md, 'link id'], to_drop[to_drop | no_md]):
+            if dropped:
                 print('link id' + str(link_id) + ' has been dropped')
-                num_cmls_map = num_cmls_map - 1
-                continue
-            if math.isnan(link['rx site latitude']):
-                print('No metadata for link ' + str(link['link id']))
-                num_cmls_map = num_cmls_map - 1
-                continue
             else:
-                if link_id in self.list_of_link_id_to_color or hop_id in self.list_of_link_id_to_color:
-                    self.color = self.color_of_specific_links
-                else:
-                    self.color = d_colors[link['link carrier']]
-                if self.rawdata_dir:
-                    try:
-                        self._process_rd(link, link_id, 'Cellcom_HC_RADIO_SINK_', 'PowerRLTMmin')
-                    except:
-                        pass
-                    try:
-                        self._process_rd(link, link_id, 'PHI_TN_RFInputPower_', 'RFInputPower')
-                    except:
-                        pass
-                    try:
-                        self._process_rd(link, link_id, 'Pelephone_TN_RFInputPower_', 'RFInputPower')
-                    except:
-                        pass
-                    try:
-                        self._process_rd(link, link_id, 'SMBIT', 'lastvalue')
-                    except:
-                        pass
-                    try:
-                        self._process_rd(link, link_id, 'Ericsson_MW_', 'rsl')
-                    except:
-                        pass
-                else:
-                    folium.PolyLine([(link['rx site latitude'],
-                                      link['rx site longitude']),
-                                     (link['tx site latitude'],
-                                      link['tx site longitude'])],
-                                    color=self.color,
-                                    opacity=0.6,
-                                    popup=str(link['link carrier']) +\
-                                          '\nLink ID: ' + str(link['link id']) +\
-                                           '\nHop ID: ' + str(link['hop id'])
-                                ).add_to(self.map_1)
-    
-        print('Number of links in map: ')
-        print(num_cmls_map)
-        print(str(self.out_path.joinpath(self.name_of_map_file)))
-        self.map_1.save(str(self.out_path.joinpath(self.name_of_map_file)))
-    
-        # plot gridlines
-        if self.num_of_gridlines:
-            lat_min = np.nanmin((np.nanmin(df_md['tx site latitude'].values),
-                                np.nanmin(df_md['rx site latitude'].values)))
-            lon_min = np.nanmin((np.nanmin(df_md['tx site longitude'].values),
-                                np.nanmin(df_md['rx site longitude'].values)))
-            lat_max = np.nanmax((np.nanmax(df_md['tx site latitude'].values),
-                                np.nanmax(df_md['rx site latitude'].values)))
-            lon_max = np.nanmax((np.nanmax(df_md['tx site longitude'].values),
-                                np.nanmax(df_md['rx site longitude'].values)))
-    
-            lats = np.linspace(lat_min,lat_max,self.num_of_gridlines)
-            lons = np.linspace(lon_min,lon_max,self.num_of_gridlines)
-    
-            for lat in lats:
-                grid.append([[lat, -180],[lat, 180]])
-    
-            for lon in lons:
-                grid.append([[-90, lon],[90, lon]])
-    
-            counter = 0
-            for g in grid:
-                if counter < len (lats):
-                    folium.PolyLine(g, color="black", weight=0.5,
-                                    opacity=0.5,popup=str(round(g[0][0],5))).add_to(self.map_1)
-                    counter += 1
-                else:
-                    folium.PolyLine(g, color="black", weight=0.5,
-                                    opacity=0.5,popup=str(round(g[0][1],5))).add_to(self.map_1)
-    
-        self.map_1.save(str(self.out_path.joinpath(self.name_of_map_file)))
-    
-        print('Map under the name ' + self.name_of_map_file + ' was generated.')
+                print('No metadata for link ' + str(link_id))
+        self.stats.skip('dropped', df_md.loc[to_drop, 'link id'])
+        self.stats.skip('no metadata', df_md.loc[no_md, 'link id'])
+        if self.carriers is not None:
+            other_carrier = ~(to_drop | no_md) & \
+                            ~df_md['link carrier'].isin([str(c).lower() for c in self.carriers])
+            self.stats.skip('other carrier', df_md.loc[other_carrier, 'link id'])
+            to_drop = to_drop | other_carrier
+        num_cmls_map = num_cmls_map - int((to_drop | no_md).sum())
+        to_color = set(self.list_of_link_id_to_color)
+        highlight = df_md['link id'].isin(to_color) | df_md['hop id'].isin(to_color)
+        carrier_colors = df_md['link carrier'].map(d_colors).fillna(d_colors['unknown carrier'])
+        df_md['link color'] = np.where(highlight, self.color_of_specific_links, carrier_colors)
+        df_links = df_md[~(to_drop | no_md)]
+        if self.distort_lat_lon:
+            df_links = self._deoverlap(df_links)
+        return df_md, df_links, num_cmls_map
+
+    def _draw_gridlines(self, df_md):
+        lat_min = np.nanmin((np.nanmin(df_md['tx site latitude'].values),
+                            np.nanmin(df_md['rx site latitude'].values)))
+        lon_min = np.nanmin((np.nanmin(df_md['tx site longitude'].values),
+                            np.nanmin(df_md['rx site longitude'].values)))
+        lat_max = np.nanmax((np.nanmax(df_md['tx site latitude'].values),
+                            np.nanmax(df_md['rx site latitude'].values)))
+        lon_max = np.nanmax((np.nanmax(df_md['tx site longitude'].values),
+                            np.nanmax(df_md['rx site longitude'].values)))
+
+        grid = []
+        lats = np.linspace(lat_min,lat_max,self.num_of_gridlines)
+        lons = np.linspace(lon_min,lon_max,self.num_of_gridlines)
+
+        for lat in lats:
+            grid.append([[lat, -180],[lat, 180]])
+
+        for lon in lons:
+            grid.append([[-90, lon],[90, lon]])
+
+        counter = 0
+        for g in grid:
+            if counter < len (lats):
+                folium.PolyLine(g, color="black", weight=0.5,
+                                opacity=0.5,popup=str(round(g[0][0],5))).add_to(self.map_1)
+                counter += 1
+            else:
+                folium.PolyLine(g, color="black", weight=0.5,
+                                opacity=0.5,popup=str(round(g[0][1],5))).add_to(self.map_1)
+
+    def _add_geojson_links(self, df, colors):
+        # draw all links as one FeatureCollection, popups are built client side
+        coords = np.column_stack((df['rx site longitude'].values, df['rx site latitude'].values,
+                                  df['tx site longitude'].values, df['tx site latitude'].values))
+        coords = coords.astype(np.float64).round(6).tolist()
+        features = [{'type': 'Feature',
+                     'id': i,
+                     'geometry': {'type': 'LineString',
+                                  'coordinates': [[c[0], c[1]], [c[2], c[3]]]},
+                     'properties': {'link carrier': carrier,
+                                    'link id': link_id,
+                                    'hop id': hop_id,
+                                    'color': color}}
+                    for i, (c, carrier, link_id, hop_id, color) in enumerate(
+                        zip(coords,
+                            df['link carrier'].astype(str).tolist(),
+                            df['link id'].astype(str).tolist(),
+                            df['hop id'].astype(str).tolist(),
+                            colors))]
+        folium.GeoJson({'type': 'FeatureCollection', 'features': features},
+                       style_function=lambda feature: {'color': feature['properties']['color'],
+                                                       'weight': 3,
+                                                       'opacity': 0.6},
+                       popup=folium.GeoJsonPopup(fields=['link carrier', 'link id', 'hop id'],
+                                                 aliases=['', 'Link ID:', 'Hop ID:'],
+                                                 labels=True)
+                       ).add_to(self.map_1)
 
     def _process_rd(self, link, link_id, str_in_filename, str_rsl_col):
         str_rsl_col = str_rsl_col.lower()
-        appended_data = []
-        # loop over rsl raw data
-        for filename in sorted(os.listdir(self.rawdata_path)):
-            if 'SMBIT' in filename and link_id in filename.lower():
-                f = open(self.rawdata_path.joinpath(filename))
-                f_content = self._load_json_file(f)
-                dic = self._load_raw_data(f_content, str_rsl_col)
-                df_temp = pd.DataFrame(dic, dtype=np.int32)
-                df_temp['time'] = pd.to_datetime(df_temp['clk'], unit='s')
-                appended_data.append(df_temp)
-            elif str_in_filename + link_id in filename:
-                # if link_id in filename:
-                if str_in_filename=='Ericsson_MW_':
-                    cols_names = ['time','link id','tsl', str_rsl_col]
-                    df_temp = pd.read_csv(self.rawdata_path.joinpath(filename),
-                                          names=cols_names,
-                                          header=None)
-                else:
-                    df_temp = pd.read_csv(self.rawdata_path.joinpath(filename))
-                appended_data.append(df_temp)
+        # the rsl raw data files of this link only
+        filenames = self._rd_filenames(str_in_filename, link_id)
+        if (self.start is not None or self.end is not None) and not self.rd_cache_dir:
+            filenames = [filename for filename in filenames
+                         if self._file_in_window(filename, str_in_filename)]
+        if self.memory_budget_mb:
+            df, note = self._stream_rd(filenames, str_in_filename, str_rsl_col)
+        else:
+            df, note = self._load_rd(link_id, filenames, str_in_filename, str_rsl_col)
+        if df is None:
+            return None
+
+        ## create json of each cml timeseries for plotting
+        y_title = None
+        if self.resample:
+            y_title = 'Availability' if self.aggregation == ['availability'] else 'RSL (dB)'
+        elif self.decimation:
+            df = self._decimate(df, str_rsl_col)
+        if self.rsl_sidecar:
+            return 'sidecar', self._write_rsl_sidecar(link, df, str_in_filename, str_rsl_col,
+                                                      note, y_title)
+        timeseries = vincent.Line(
+            df,
+            height=350,
+            width=750).axis_titles(
+            x=link['link carrier'] + ':  (Date)',
+            y=y_title or 'RSL (dB)'
+        )
+        timeseries.legend(title='Link ID: ' + str(link['link id']) + \
+                                '\nHop ID: ' + str(link['hop id']) + \
+                                ('\n' + note if note else ''))
+        return 'vega', json.loads(timeseries.to_json())
+
+    def _load_rd(self, link_id, filenames, str_in_filename, str_rsl_col):
+        # returns the timeseries of a link (aggregated with resample) and its availability
+        # note, from all its raw files at once. None if there is no data.
+        if self.rd_cache_dir:
+            appended_data = self._read_rd_cache(link_id, filenames, str_in_filename, str_rsl_col)
+        else:
+            appended_data = [self._read_rd_file(filename, str_in_filename, str_rsl_col)
+                             for filename in filenames]
         if not appended_data:
-            pass
+            return None, ''
+        df_ts = pd.concat(appended_data, sort=False)
+        df_ts.columns = df_ts.columns.str.lower()
+        if 'interval' in df_ts.columns:
+            df_ts = df_ts[df_ts['interval'] == self.interval]
+        df_ts.reset_index(inplace=True, drop=True)
+        df_ts['date'] = pd.to_datetime(df_ts['time'])
+        if self.start is not None or self.end is not None:
+            df_ts = df_ts[self._in_window(df_ts['date'])]
+            if df_ts.empty:
+                return None, ''
+        df = df_ts[['date', str_rsl_col]]
+        df.set_index('date', inplace=True, drop=True)
+        note = ''
+        if self.resample:
+            if 'availability' in self.aggregation:
+                note = self._availability(df[str_rsl_col].count(), df.index.min(), df.index.max())
+            df = self._aggregate(df, str_rsl_col)
+        return df, note
+
+    def _stream_rd(self, filenames, str_in_filename, str_rsl_col):
+        # returns the timeseries of a link (aggregated with resample) and its availability
+        # note, reading its raw files chunk by chunk (see _iter_rd_chunks) and reducing
+        # them on the fly: to partial aggregates of each resample period, or to the samples
+        # that fit in the memory budget (decimated when they do not). None if there is no data.
+        max_samples = max(4 * self.max_points, self._memory_budget() // 4 // STREAM_SAMPLE_BYTES)
+        size = min(max_samples, 1 << 16)
+        t = np.empty(size, dtype=np.int64)
+        y = np.empty(size, dtype=np.float64)
+        n, count, first, last, tz = 0, 0, None, None, None
+        partials, integer, compacted = [], True, False
+        for dates, rsl in self._iter_rd_chunks(filenames, str_in_filename, str_rsl_col):
+            if not len(dates):
+                continue
+            tz = dates.tz
+            integer = integer and rsl.dtype.kind in 'iu'
+            rsl = rsl.astype(np.float64)
+            count += int(np.count_nonzero(~np.isnan(rsl)))
+            first = dates.min() if first is None else min(first, dates.min())
+            last = dates.max() if last is None else max(last, dates.max())
+            if self.resample:
+                partials.append(pd.Series(rsl).groupby(self._bucket_starts(dates))
+                                .agg(['min', 'max', 'sum', 'count']))
+                if len(partials) >= STREAM_MAX_PARTIALS:
+                    partials = [self._combine_partials(partials)]
+                continue
+            ns = dates.asi8
+            if n + len(ns) > len(t):
+                size = len(t)
+                while n + len(ns) > size and size < max_samples:
+                    size = min(2 * size, max_samples)
+                if n + len(ns) > size:
+                    # over the budget: keep the decimated samples only
+                    t, y, n = self._compact(np.append(t[:n], ns), np.append(y[:n], rsl), max_samples // 2)
+                    integer, compacted = False, True
+                    t = np.resize(t, max_samples)
+                    y = np.resize(y, max_samples)
+                    continue
+                t = np.resize(t, size)
+                y = np.resize(y, size)
+            t[n:n + len(ns)] = ns
+            y[n:n + len(ns)] = rsl
+            n += len(ns)
+        if first is None:
+            return None, ''
+        note = ''
+        if self.resample:
+            if 'availability' in self.aggregation:
+                note = self._availability(count, first, last)
+            return self._finish_partials(self._combine_partials(partials), str_rsl_col), note
+        if compacted:
+            # the samples compacted early are sparser than the last ones, decimate them
+            # all again by time
+            t, y, n = self._compact(t[:n], y[:n], self.max_points)
+        index = pd.DatetimeIndex(pd.to_datetime(t[:n]), name='date')
+        if tz is not None:
+            index = index.tz_localize('UTC').tz_convert(tz)
+        # integer rsl (as read) stays integer
+        return pd.DataFrame({str_rsl_col: y[:n].astype(np.int64) if integer else y[:n]}, index=index), note
+
+    def _iter_rd_chunks(self, filenames, str_in_filename, str_rsl_col):
+        # yields (dates, rsl) of the raw files of a link, chunk by chunk, filtered by
+        # interval and start/end
+        rows = self._stream_rows()
+        for filename in filenames:
+            path = self.rawdata_path.joinpath(filename)
+            self.stats.add_file(str_in_filename, os.path.getsize(path))
+            if str_in_filename == 'SMBIT':
+                chunks = (pd.DataFrame({'time': pd.to_datetime(clk, unit='s'),
+                                        str_rsl_col: rsl})
+                          for rsl, clk in self._iter_raw_data(path))
+            elif str_in_filename == 'Ericsson_MW_':
+                chunks = pd.read_csv(path, names=['time', 'link id', 'tsl', str_rsl_col],
+                                     header=None, chunksize=rows)
+            else:
+                chunks = pd.read_csv(path, chunksize=rows)
+            for chunk in chunks:
+                chunk.columns = chunk.columns.str.lower()
+                if 'interval' in chunk.columns:
+                    chunk = chunk[chunk['interval'] == self.interval]
+                dates = pd.to_datetime(chunk['time'])
+                rsl = chunk[str_rsl_col].values
+                if self.start is not None or self.end is not None:
+                    mask = self._in_window(dates)
+                    dates, rsl = dates[mask], rsl[mask]
+                yield pd.DatetimeIndex(dates), rsl
+
+    def _compact(self, t, y, n_out):
+        # returns the samples (times in ns) reduced to about n_out by decimation
+        # (minmax of equal time spans if not set), in time order, and their number
+        order = np.argsort(t, kind='stable')
+        t, y = t[order], y[order]
+        keep = ~np.isnan(y)
+        t, y = t[keep], y[keep]
+        if self.decimation == 'lttb':
+            idx = lttb_indices(t / 1e9, y, n_out)
         else:
-            df_ts = pd.concat(appended_data, sort=False)
-            df_ts.columns = df_ts.columns.str.lower()
+            idx = minmax_indices(y, n_out, t)
+        return t[idx], y[idx], len(idx)
+
+    def _combine_partials(self, partials):
+        # min, max, sum and count of each resample period over partial aggregates
+        return pd.concat(partials).groupby(level=0).agg(
+            {'min': 'min', 'max': 'max', 'sum': 'sum', 'count': 'sum'})
+
+    def _finish_partials(self, partials, str_rsl_col):
+        # the columns of _aggregate from the partial aggregates of each resample period
+        starts, lengths = self._buckets(partials.index.min(), partials.index.max())
+        buckets = partials.reindex(starts)
+        count = buckets['count'].fillna(0)
+        columns = {}
+        for how in self.aggregation:
+            if how == 'availability':
+                columns[how] = (count / (lengths / self._sample_period())).clip(upper=1)
+            elif how == 'mean':
+                columns[str_rsl_col + ' mean'] = buckets['sum'] / count.where(count > 0)
+            else:
+                columns[str_rsl_col + ' ' + how] = buckets[how]
+        return pd.DataFrame(columns).dropna(how='all')
+
+    def _in_window(self, dates):
+        # mask of the dates from start and before end
+        tz = getattr(dates.dt, 'tz', None)
+        mask = np.ones(len(dates), dtype=bool)
+        for bound, keep in ((self.start, dates.__ge__), (self.end, dates.__lt__)):
+            if bound is not None:
+                mask &= keep(self._bound(bound, tz)).values
+        return mask
+
+    def _bound(self, bound, tz):
+        # start/end as a Timestamp comparable to times of time zone tz
+        bound = pd.Timestamp(bound)
+        if tz is not None and bound.tz is None:
+            bound = bound.tz_localize(tz)
+        elif tz is None and bound.tz is not None:
+            bound = bound.tz_localize(None)
+        return bound
+
+    def _file_in_window(self, filename, str_in_filename):
+        # False if the first and last records of the raw file are both before start or
+        # both from end on, when the file is not read at all
+        first_last = self._file_time_range(self.rawdata_path.joinpath(filename), str_in_filename)
+        if first_last is None:
+            return True
+        first, last = first_last
+        if (self.start is not None and last < self._bound(self.start, last.tz)) or \
+                (self.end is not None and first >= self._bound(self.end, first.tz)):
+            self.stats.add_pruned(str_in_filename)
+            return False
+        return True
+
+    def _file_time_range(self, path, str_in_filename):
+        # returns the times of the first and the last records of a raw file, read from
+        # RD_PEEK_SIZE bytes at its start and its end only. None if they cannot be found
+        # or are not in order.
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            head = f.read(RD_PEEK_SIZE).decode(errors='ignore')
+            f.seek(max(0, size - RD_PEEK_SIZE))
+            tail = f.read().decode(errors='ignore')
+        try:
+            if str_in_filename == 'SMBIT':
+                clocks = [dict(SMBIT_FIELD_RE.findall(match.group(1))).get('lastclock', '0')
+                          for text in (head, tail) for match in SMBIT_RSSAVG_RE.finditer(text)]
+                clocks = [int(clock) + 7200 for clock in clocks if clock != '0']
+                first, last = pd.Timestamp(clocks[0], unit='s'), pd.Timestamp(clocks[-1], unit='s')
+            else:
+                head_lines = [line for line in head.splitlines() if line.strip()]
+                tail_lines = [line for line in tail.splitlines() if line.strip()]
+                if str_in_filename == 'Ericsson_MW_':
+                    col, first_line = 0, head_lines[0]
+                else:
+                    header = next(csv.reader([head_lines[0]]))
+                    col, first_line = [c.strip().lower() for c in header].index('time'), head_lines[1]
+                first = pd.Timestamp(next(csv.reader([first_line]))[col])
+                last = pd.Timestamp(next(csv.reader([tail_lines[-1]]))[col])
+        except (ValueError, IndexError, TypeError):
+            return None
+        if first > last:
+            return None
+        return first, last
+
+    def _sample_period(self):
+        # time between two samples by interval
+        return pd.Timedelta(hours=24) if self.interval == 24 else pd.Timedelta(minutes=self.interval)
+
+    def _availability(self, count, first, last):
+        # note of the fraction of the expected samples from start (or the first sample)
+        # to end (or after the last sample) that were measured (count)
+        t0 = self._bound(self.start, first.tz) if self.start is not None else first
+        t1 = self._bound(self.end, last.tz) if self.end is not None else last + self._sample_period()
+        expected = (t1 - t0) / self._sample_period()
+        return 'Availability: {:.1%}'.format(min(1.0, count / expected) if expected > 0 else 0.0)
+
+    def _bucket_starts(self, dates):
+        # start of the resample period of each time: calendar periods (e.g. 'M', 'W') from
+        # their real start, fixed periods (e.g. '6H') counted from the epoch
+        offset = pd.tseries.frequencies.to_offset(self.resample)
+        if isinstance(offset, pd.offsets.Tick):
+            return dates.floor(offset)
+        starts = dates.tz_localize(None).to_period(offset).start_time
+        return starts.tz_localize(dates.tz) if dates.tz is not None else starts
+
+    def _buckets(self, first, last):
+        # starts and lengths of all the resample periods from first to last (period starts)
+        offset = pd.tseries.frequencies.to_offset(self.resample)
+        if isinstance(offset, pd.offsets.Tick):
+            starts = pd.date_range(first, last, freq=offset, name='date')
+            return starts, pd.Series(pd.Timedelta(offset), index=starts)
+        tz = first.tz
+        periods = pd.period_range(first.tz_localize(None), last.tz_localize(None), freq=offset)
+        starts, ends = periods.start_time, periods.end_time + pd.Timedelta(1, 'ns')
+        if tz is not None:
+            starts, ends = starts.tz_localize(tz), ends.tz_localize(tz)
+        starts = starts.rename('date')
+        return starts, pd.Series(ends - starts, index=starts)
+
+    def _aggregate(self, df, str_rsl_col):
+        # resample the timeseries to one row per resample period, with a column per aggregation
+        rsl = df[str_rsl_col].astype(np.float64)
+        partials = rsl.groupby(self._bucket_starts(rsl.index)).agg(['min', 'max', 'sum', 'count'])
+        return self._finish_partials(partials, str_rsl_col)
+
+    def _read_rd_file(self, filename, str_in_filename, str_rsl_col):
+        # returns the raw data of one file as found in the file
+        self.stats.add_file(str_in_filename, os.path.getsize(self.rawdata_path.joinpath(filename)))
+        if str_in_filename == 'SMBIT':
+            dic = self._load_raw_data(self.rawdata_path.joinpath(filename), str_rsl_col)
+            df_temp = pd.DataFrame(dic)
+            df_temp['clk'] = df_temp['clk'].astype(np.int32)
+            df_temp['time'] = pd.to_datetime(df_temp['clk'], unit='s')
+        elif str_in_filename=='Ericsson_MW_':
+            cols_names = ['time','link id','tsl', str_rsl_col]
+            df_temp = pd.read_csv(self.rawdata_path.joinpath(filename),
+                                  names=cols_names,
+                                  header=None)
+        else:
+            df_temp = pd.read_csv(self.rawdata_path.joinpath(filename))
+        return df_temp
+
+    def _read_rd_cache(self, link_id, filenames, str_in_filename, str_rsl_col):
+        # returns the raw data of a link from its .npz file in rd_cache_dir: time (int64 ns),
+        # rsl (float64, as read), interval (float32, nan if not given) and the source file of
+        # each row, and whether the rsl of each file is integer. Only raw files that are new
+        # or changed (mtime/size) since they were cached are parsed, rows of files that no
+        # longer exist are dropped.
+        if not filenames:
+            return []
+        cache_file = Path(self.rd_cache_dir).joinpath(self._link_key(str_in_filename, link_id) + '.npz')
+        stats = {}
+        for filename in filenames:
+            st = os.stat(self.rawdata_path.joinpath(filename))
+            stats[filename] = (st.st_mtime_ns, st.st_size)
+        files, arrays, integer = [], {'time': [], 'rsl': [], 'interval': [], 'src': []}, []
+        changed = not cache_file.exists()
+        if not changed:
             try:
-                df_ts = df_ts[df_ts['interval'] == self.interval]
-            except:
-                pass
-            df_ts.reset_index(inplace=True, drop=True)
-            df_ts['date'] = pd.to_datetime(df_ts['time'])
-
-            ## create json of each cml timeseries for plotting
-            df = df_ts[['date', str_rsl_col]]
-            df.set_index('date', inplace=True, drop=True)
-            timeseries = vincent.Line(
-                df[[str_rsl_col]],
-                height=350,
-                width=750).axis_titles(
-                x=link['link carrier'] + ':  (Date)',
-                y='RSL (dB)'
-            )
-            timeseries.legend(title='Link ID: ' + str(link['link id']) + \
-                                    '\nHop ID: ' + str(link['hop id']))
-            data_json = json.loads(timeseries.to_json())
-
-            v = folium.features.Vega(data_json, width=1000, height=400)
-            p = folium.Popup(max_width=1150)
+                with np.load(cache_file) as cache:
+                    cached = cache['files'].tolist()
+                    keep = [i for i, filename in enumerate(cached)
+                            if stats.get(filename) == (cache['mtimes'][i], cache['sizes'][i])]
+                    if 'integer' not in cache.files or cache['rsl'].dtype != np.float64:
+                        # written by an older version, with the rsl rounded to float32
+                        keep = []
+                    changed = len(keep) != len(cached) or len(keep) != len(filenames)
+                    rows = np.isin(cache['src'], keep)
+                    for col in ('time', 'rsl', 'interval'):
+                        arrays[col].append(cache[col][rows])
+                    # renumber the kept source files
+                    src_map = np.full(len(cached), -1, dtype=np.int32)
+                    src_map[keep] = np.arange(len(keep), dtype=np.int32)
+                    arrays['src'].append(src_map[cache['src'][rows]])
+                    files = [cached[i] for i in keep]
+                    integer = [bool(cache['integer'][i]) for i in keep]
+            except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+                # damaged cache file: parse all the raw files again
+                files, arrays, integer = [], {'time': [], 'rsl': [], 'interval': [], 'src': []}, []
+                changed = True
+        for filename in filenames:
+            if filename in files:
+                continue
+            df_temp = self._read_rd_file(filename, str_in_filename, str_rsl_col)
+            df_temp.columns = df_temp.columns.str.lower()
+            time = pd.to_datetime(df_temp['time'])
+            if getattr(time.dt, 'tz', None) is not None:
+                time = time.dt.tz_localize(None)
+            arrays['time'].append(time.values.astype('datetime64[ns]').astype(np.int64))
+            integer.append(df_temp[str_rsl_col].dtype.kind in 'iu')
+            arrays['rsl'].append(df_temp[str_rsl_col].values.astype(np.float64))
+            if 'interval' in df_temp.columns:
+                arrays['interval'].append(df_temp['interval'].values.astype(np.float32))
+            else:
+                arrays['interval'].append(np.full(len(df_temp), np.nan, dtype=np.float32))
+            arrays['src'].append(np.full(len(df_temp), len(files), dtype=np.int32))
+            files.append(filename)
+        arrays = {col: np.concatenate(values) if values else np.array([])
+                  for col, values in arrays.items()}
+        if changed:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            # per process, so that maps drawn in parallel never write the same temporary file
+            tmp_file = cache_file.with_name(cache_file.stem + '.' + str(os.getpid()) + '.tmp.npz')
+            np.savez(tmp_file,
+                     files=np.array(files, dtype=str),
+                     mtimes=np.array([stats[f][0] for f in files], dtype=np.int64),
+                     sizes=np.array([stats[f][1] for f in files], dtype=np.int64),
+                     integer=np.array(integer, dtype=bool),
+                     **arrays)
+            os.replace(tmp_file, cache_file)
+        # rows in the order of the raw files, as when reading them directly
+        position = {filename: i for i, filename in enumerate(filenames)}
+        file_order = np.array([position[filename] for filename in files], dtype=np.int64)
+        order = np.argsort(file_order[arrays['src']], kind='stable')
+        rsl = arrays['rsl'][order]
+        # integer rsl (as read) stays integer
+        df_ts = pd.DataFrame({'time': pd.to_datetime(arrays['time'][order]),
+                              str_rsl_col: rsl.astype(np.int64) if all(integer) else rsl})
+        if not np.isnan(arrays['interval']).all():
+            df_ts['interval'] = arrays['interval'][order]
+        return [df_ts]
+
+    def _link_key(self, str_in_filename, link_id):
+        # file name safe key of the raw data of a link, with a short hash of the link id so
+        # that ids differing only in unsafe characters (e.g. 'a.b', 'a b') get different keys
+        name = str_in_filename.rstrip('_') + '_' + str(link_id)
+        return re.sub(r'[^A-Za-z0-9_-]', '_', name) + '_' + hashlib.sha1(name.encode()).hexdigest()[:8]
+
+    def _decimate(self, df, str_rsl_col):
+        # keep at most max_points samples of the timeseries for the chart
+        df = df[df[str_rsl_col].notna()].sort_index()
+        y = df[str_rsl_col].values.astype(np.float64)
+        x = df.index.values.astype('datetime64[ns]').astype(np.int64) / 1e9
+        if self.decimation == 'lttb':
+            idx = lttb_indices(x, y, self.max_points)
+        else:
+            # buckets of equal time, so that gaps in the data are not stretched
+            idx = minmax_indices(y, self.max_points, x)
+        return df.iloc[idx]
+
+    def _process_rd_link(self, link):
+        # returns the popups (kind, data) of all the raw data found for a link
+        popups = []
+        t0 = time.perf_counter()
+        for str_in_filename, str_rsl_col in RD_FILE_PREFIXES.items():
+            try:
+                popup = self._process_rd(link, link['link id'], str_in_filename, str_rsl_col)
+            except Exception as e:
+                self.stats.fail(link['link id'], str_in_filename + ': ' + type(e).__name__ + ': ' + str(e))
+                popup = None
+            if popup:
+                popups.append(popup)
+        self.stats.add_link(link['link id'], time.perf_counter() - t0)
+        return popups
+
+    def _deoverlap(self, df):
+        # links whose two sites are the same (coordinates rounded to DEOVERLAP_DECIMALS, in
+        # either direction) are shifted perpendicularly to their direction, in order of
+        # link id, DEOVERLAP_SPACING degrees apart and centered on the original line
+        cols = ['rx site longitude', 'rx site latitude', 'tx site longitude', 'tx site latitude']
+        coords = df[cols].values.astype(np.float64)
+        sites = np.round(coords * 10 ** DEOVERLAP_DECIMALS).astype(np.int64)
+        a, b = sites[:, :2], sites[:, 2:]
+        swap = (a[:, 0] > b[:, 0]) | ((a[:, 0] == b[:, 0]) & (a[:, 1] > b[:, 1]))
+        p = np.where(swap[:, None], b, a)
+        q = np.where(swap[:, None], a, b)
+        link_ids = df['link id'].astype(str).values
+        order = np.lexsort((link_ids, q[:, 1], q[:, 0], p[:, 1], p[:, 0]))
+        key = np.column_stack((p, q))[order]
+        new_group = np.r_[True, np.any(key[1:] != key[:-1], axis=1)]
+        group = np.cumsum(new_group) - 1
+        group_start = np.flatnonzero(new_group)
+        group_size = np.diff(np.r_[group_start, len(order)])
+        rank = np.empty(len(order))
+        rank[order] = np.arange(len(order)) - group_start[group]
+        size = np.empty(len(order))
+        size[order] = group_size[group]
+        offset = (rank - (size - 1) / 2) * DEOVERLAP_SPACING
+        # unit vector perpendicular to the (direction independent) line between the sites
+        dx = (q[:, 0] - p[:, 0]).astype(np.float64)
+        dy = (q[:, 1] - p[:, 1]).astype(np.float64)
+        norm = np.hypot(dx, dy)
+        same_site = norm == 0
+        norm[same_site] = 1
+        perp_lon = np.where(same_site, 0, -dy / norm)
+        perp_lat = np.where(same_site, 1, dx / norm)
+        df = df.copy()
+        for site in ('rx', 'tx'):
+            df[site + ' site longitude'] = df[site + ' site longitude'] + offset * perp_lon
+            df[site + ' site latitude'] = df[site + ' site latitude'] + offset * perp_lat
+        return df
+
+    def _save_map(self, path):
+        # folium names its elements with random ids, number them in order instead
+        # so that the same map is saved to the same file
+        stack, elements, old_names = [self.map_1.get_root()], [], {}
+        while stack:
+            element = stack.pop(0)
+            if id(element) in old_names:
+                continue
+            old_names[id(element)] = element.get_name()
+            element._id = '{:032x}'.format(len(elements))
+            elements.append(element)
+            children = [v for k, v in vars(element).items()
+                        if k != '_parent' and isinstance(v, Element)]
+            stack.extend(children + [v for v in element._children.values() if isinstance(v, Element)])
+        # children are kept by name, unless they were added under a name of their own
+        for element in elements:
+            element._children = OrderedDict(
+                (child.get_name() if name == old_names.get(id(child)) else name, child)
+                for name, child in element._children.items())
+        self.map_1.save(path)
+
+    def _draw_links(self, df_links, all_popups=None):
+        # draw the selected links on self.map_1, with the popups of their raw data
+        # (all_popups, processed here if not given)
+        if self.rawdata_dir:
+            links = df_links.to_dict('records')
+            if all_popups is None:
+                all_popups = self._rd_popups(links)
+            for link, popups in zip(links, all_popups):
+                for kind, data in popups:
+                    self._add_rd_popup(link, link['link color'], kind, data)
+        elif self.as_geojson:
+            self._add_geojson_links(df_links, df_links['link color'].tolist())
+        else:
+            for link in df_links.to_dict('records'):
+                folium.PolyLine([(link['rx site latitude'],
+                                  link['rx site longitude']),
+                                 (link['tx site latitude'],
+                                  link['tx site longitude'])],
+                                color=link['link color'],
+                                opacity=0.6,
+                                popup=str(link['link carrier']) +\
+                                      '\nLink ID: ' + str(link['link id']) +\
+                                       '\nHop ID: ' + str(link['hop id'])
+                            ).add_to(self.map_1)
 
-            pl = folium.PolyLine([(link['rx site latitude'],
-                                   link['rx site longitude']),
-                                  (link['tx site latitude'],
-                                   link['tx site longitude'])],
-                                 color=self.color,
-                                 opacity=0.6
-                                 ).add_to(self.map_1)
-            pl.add_child(p)
+    def _draw_tiles(self):
+        # draw the links of each tile (by the midpoint of the link) on a sub-map of its own,
+        # and the number of links per tile on self.map_1, linking to the sub-maps.
+        # The raw data of all the links is processed at once, then split by tile.
+        overview_map = self.map_1
+        tiles = self.spatial_index.tiles()
+        all_popups = None
+        if self.rawdata_dir:
+            all_popups = self._rd_popups(self.spatial_index.df.to_dict('records'))
+        max_count = max([len(rows) for rows in tiles.values()] + [1])
+        colormap = branca.colormap.linear.YlOrRd_09.scale(0, max_count)
+        colormap.caption = 'Number of links'
+        density = folium.FeatureGroup(name='link density')
+        for (ix, iy), rows in sorted(tiles.items()):
+            bounds = [[iy * self.tile_size, ix * self.tile_size],
+                      [(iy + 1) * self.tile_size, (ix + 1) * self.tile_size]]
+            tile_file_name = self.name_of_map_file[:-len('.html')] + \
+                             '_tile_{}_{}.html'.format(ix, iy)
+            self.map_1 = self._new_map()
+            self.map_1.fit_bounds(bounds)
+            self._draw_links(self.spatial_index.df.iloc[rows],
+                             [all_popups[row] for row in rows] if all_popups is not None else None)
+            self._save_map(str(self.out_path.joinpath(tile_file_name)))
+            folium.Rectangle(bounds,
+                             color=colormap(len(rows)),
+                             weight=1,
+                             fill=True,
+                             fill_opacity=0.5,
+                             popup=folium.Popup('<a href="{}" target="_blank">{} links</a>'.format(
+                                 tile_file_name, len(rows)))
+                             ).add_to(density)
+        self.map_1 = overview_map
+        density.add_to(self.map_1)
+        colormap.add_to(self.map_1)
+        print('Number of tiles: ')
+        print(len(tiles))
+
+    def _rd_popups(self, links):
+        # process the raw data of the links (in parallel if workers > 1) and return the
+        # popups of each, in order. Folium objects are only created in this process.
+        # With render_cache_dir, links whose fingerprint is unchanged reuse their popups.
+        all_popups = [None] * len(links)
+        if self.render_cache_dir:
+            fingerprints = [self._link_fingerprint(link) for link in links]
+            for i, link in enumerate(links):
+                all_popups[i] = self._read_fragment(link, fingerprints[i])
+        todo = [i for i, popups in enumerate(all_popups) if popups is None]
+        todo_links = [links[i] for i in todo]
+        if self.workers and self.workers > 1 and len(todo_links) > 1:
+            state = {k: v for k, v in self.__dict__.items() if k not in ('map_1', '_rsl_loader', 'stats')}
+            chunksize = max(1, len(todo_links) // (self.workers * 4))
+            with ProcessPoolExecutor(max_workers=self.workers,
+                                     initializer=_init_rd_worker,
+                                     initargs=(state,)) as executor:
+                new_popups = []
+                for popups, stats in executor.map(_rd_worker_job, todo_links, chunksize=chunksize):
+                    self.stats.merge(stats)
+                    new_popups.append(popups)
+        else:
+            new_popups = map(self._process_rd_link, todo_links)
+        for i, popups in zip(todo, new_popups):
+            all_popups[i] = popups
+            if self.render_cache_dir:
+                self._write_fragment(links[i], fingerprints[i], popups)
+        if self.render_cache_dir:
+            print('Links rendered: ' + str(len(todo)) + ', reused: ' + str(len(links) - len(todo)))
+        self.stats.skip('no raw data', [link['link id'] for link, popups in zip(links, all_popups)
+                                        if not popups and link['link id'] not in self.stats.failed])
+        return all_popups
+
+    def _link_fingerprint(self, link):
+        # hash of everything the popups of a link depend on: its metadata, the names,
+        # mtimes and sizes of its raw files and the options of the call
+        files = {}
+        for str_in_filename in RD_FILE_PREFIXES:
+            for filename in self._rd_filenames(str_in_filename, link['link id']):
+                st = os.stat(self.rawdata_path.joinpath(filename))
+                files[str_in_filename + '/' + filename] = [st.st_mtime_ns, st.st_size]
+        state = {'version': RENDER_CACHE_VERSION,
+                 'link': [str(link['link id']), str(link['hop id']), str(link['link carrier'])],
+                 'files': files,
+                 'options': [str(self.rawdata_path), self.interval, str(self.start), str(self.end),
+                             self.resample, self.aggregation, self.decimation,
+                             self.max_points, self.rsl_sidecar, self.name_of_map_file,
+                             self.memory_budget_mb, str(self.rd_cache_dir)]}
+        return hashlib.sha1(json.dumps(state, sort_keys=True).encode()).hexdigest()
+
+    def _read_fragment(self, link, fingerprint):
+        # returns the cached popups of a link, None if missing, unreadable or outdated
+        fragment_file = Path(self.render_cache_dir).joinpath(self._link_key('link', link['link id']) + '.json')
+        if not fragment_file.exists():
+            return None
+        try:
+            with open(fragment_file) as f:
+                fragment = json.load(f)
+            if fragment['fingerprint'] != fingerprint:
+                return None
+            # sidecar files the popups load must still be there
+            for kind, data in fragment['popups']:
+                if kind == 'sidecar':
+                    src = re.search(r'data-src="([^"]+)"', data).group(1)
+                    if not self.out_path.joinpath(src).exists():
+                        return None
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+        return fragment['popups']
+
+    def _write_fragment(self, link, fingerprint, popups):
+        # written to a temporary file first, so that an interrupted run or another process
+        # never leaves a partial fragment behind
+        Path(self.render_cache_dir).mkdir(parents=True, exist_ok=True)
+        fragment_file = Path(self.render_cache_dir).joinpath(self._link_key('link', link['link id']) + '.json')
+        tmp_file = fragment_file.with_name(fragment_file.stem + '.' + str(os.getpid()) + '.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'popups': popups}, f)
+        os.replace(tmp_file, fragment_file)
+
+    def _add_rd_popup(self, link, color, kind, data):
+        if kind == 'sidecar':
+            if not getattr(self, '_rsl_loader', None) or self._rsl_loader._parent is not self.map_1:
+                self._rsl_loader = RslSidecarLoader()
+                self.map_1.add_child(self._rsl_loader)
+            p = folium.Popup(data, max_width=800)
+        else:
+            v = folium.features.Vega(data, width=1000, height=400)
+            p = folium.Popup(max_width=1150)
             p.add_child(v)
+        pl = folium.PolyLine([(link['rx site latitude'],
+                               link['rx site longitude']),
+                              (link['tx site latitude'],
+                               link['tx site longitude'])],
+                             color=color,
+                             opacity=0.6
+                             ).add_to(self.map_1)
+        pl.add_child(p)
+
+    def _write_rsl_sidecar(self, link, df, str_in_filename, str_rsl_col, note='', y_title=None):
+        # write the timeseries of the link to its sidecar file and return the popup
+        # html that loads it when opened. Aggregated timeseries (several columns) are
+        # written as named series, with null where a value is missing.
+        sidecar_dir = self.name_of_map_file[:-len('.html')] + '_rsl'
+        self.out_path.joinpath(sidecar_dir).mkdir(exist_ok=True)
+        key = self._link_key(str_in_filename, link['link id'])
+        if self.resample:
+            data = {'t': (df.index.values.astype('datetime64[s]').astype(np.int64)).tolist(),
+                    'series': {col: [None if np.isnan(v) else v
+                                     for v in np.round(df[col].values.astype(np.float64), 3).tolist()]
+                               for col in df.columns}}
+        else:
+            df = df[df[str_rsl_col].notna()]
+            data = {'t': (df.index.values.astype('datetime64[s]').astype(np.int64)).tolist(),
+                    'rsl': np.round(df[str_rsl_col].values.astype(np.float64), 1).tolist()}
+        with open(self.out_path.joinpath(sidecar_dir, key + '.js'), 'w') as f:
+            f.write('cml_rsl_loaded(' + json.dumps(key) + ',' +
+                    json.dumps(data, separators=(',', ':')) + ');')
+        title = 'Link ID: ' + str(link['link id']) + ', Hop ID: ' + str(link['hop id'])
+        if note:
+            title += ', ' + note
+        popup = '<div class="cml-rsl" data-key="{}" data-src="{}" data-title="{}" data-xtitle="{}" ' \
+                '{}style="width:750px;height:350px;">Loading...</div>'.format(
+                   key, sidecar_dir + '/' + key + '.js',
+                   html.escape(title),
+                   html.escape(str(link['link carrier']) + ':  (Date)'),
+                   'data-ytitle="{}" '.format(html.escape(y_title)) if y_title else '')
+        return popup
 
-    def _load_json_file(self, file):
-        # Load and fix the file to json- SMBIT
-        data_str = file.read()
-        data_str = data_str.replace("'", '"')
-        data_str = data_str.replace("datetime", '"datetime')
-        data_str = data_str.replace(")", ')"')
-        return json.loads(data_str)
-
-    def _load_raw_data(self, file, str_rsl_col):
-        # returns a dictionary containing clock and rsl values- SMBIT
-        rsl = [float(d['siklu.rssavg']['lastvalue']) for d in file if
-               d['siklu.rssavg']['lastclock'] != '0']  # Add rsl if it is not empty
-        clk = [int(d['siklu.rssavg']['lastclock']) + 7200 for d in file if
-               d['siklu.rssavg']['lastclock'] != '0']  # Add 2 hours to clock value
+    def _rd_filenames(self, str_in_filename, link_id):
+        # the raw files of a link: by its id, or for SMBIT every file whose lowercased
+        # name contains the id
+        files = self.rd_index.get(str_in_filename, {})
+        if str_in_filename == 'SMBIT':
+            return [filename for name, filenames in files.items() if str(link_id) in name
+                    for filename in filenames]
+        return files.get(link_id, [])
+
+    def _get_rd_index(self):
+        # returns the raw-data file index, from rd_index_file if the directory and the
+        # carrier prefixes are unchanged
+        dir_mtime = os.stat(self.rawdata_path).st_mtime_ns
+        if self.rd_index_file and os.path.exists(self.rd_index_file):
+            with open(self.rd_index_file) as f:
+                saved = json.load(f)
+            if saved['rawdata_path'] == str(self.rawdata_path) and \
+                    saved['mtime_ns'] == dir_mtime and \
+                    saved.get('version') == RD_INDEX_VERSION and \
+                    saved.get('prefixes') == list(RD_FILE_PREFIXES):
+                return saved['index']
+        rd_index = self._build_rd_index()
+        if self.rd_index_file:
+            with open(self.rd_index_file, 'w') as f:
+                json.dump({'rawdata_path': str(self.rawdata_path),
+                           'mtime_ns': dir_mtime,
+                           'version': RD_INDEX_VERSION,
+                           'prefixes': list(RD_FILE_PREFIXES),
+                           'index': rd_index}, f)
+        return rd_index
+
+    def _build_rd_index(self):
+        # scan the raw-data directory once and map {carrier prefix: {link id: [filenames]}}
+        # ({lowercased name: [filenames]} for SMBIT)
+        rd_index = {str_in_filename: {} for str_in_filename in RD_FILE_PREFIXES}
+        for filename in sorted(os.listdir(self.rawdata_path)):
+            for str_in_filename, link_id in self._parse_rd_filename(filename):
+                rd_index[str_in_filename].setdefault(link_id, []).append(filename)
+        return rd_index
+
+    def _parse_rd_filename(self, filename):
+        # returns the (carrier prefix, key) keys a raw-data file can be found by.
+        # Other carriers' link ids follow their prefix directly and are separated from the
+        # rest of the name by '_', so every run of '_'-separated tokens is a candidate (link
+        # ids may contain '_' themselves). SMBIT ids may appear anywhere in the name, so
+        # SMBIT files are kept by their lowercased name and matched in _rd_filenames.
+        stem = os.path.splitext(filename)[0]
+        if 'SMBIT' in filename:
+            return {('SMBIT', filename.lower())}
+        for str_in_filename in RD_FILE_PREFIXES:
+            if str_in_filename in stem:
+                tokens = stem.split(str_in_filename, 1)[1].split('_')
+                return {(str_in_filename, '_'.join(tokens[:j]))
+                        for j in range(1, len(tokens) + 1)}
+        return set()
+
+    def _load_raw_data(self, path, str_rsl_col):
+        # returns a dictionary containing clock and rsl values- SMBIT.
+        # The chunks of _iter_raw_data are collected into arrays that grow as needed.
+        size = max(1024, os.path.getsize(path) // 256)
+        rsl = np.empty(size, dtype=np.float64)
+        clk = np.empty(size, dtype=np.int64)
+        n = 0
+        for values, clocks in self._iter_raw_data(path):
+            while n + len(values) > len(rsl):
+                rsl = np.resize(rsl, 2 * len(rsl))
+                clk = np.resize(clk, 2 * len(clk))
+            rsl[n:n + len(values)] = values
+            clk[n:n + len(values)] = clocks
+            n += len(values)
         dic = {}
-        dic[str_rsl_col] = rsl
-        dic['clk'] = clk
+        dic[str_rsl_col] = rsl[:n]
+        dic['clk'] = clk[:n]
         return dic
 
+    def _iter_raw_data(self, path):
+        # yields the rsl values and clocks of an SMBIT file chunk by chunk.
+        # The file (a python repr of a list of records) is scanned in chunks for the
+        # 'siklu.rssavg' dicts of the records, without parsing the rest of it (e.g.
+        # datetime(...) values).
+        buf = ''
+        with open(path) as f:
+            while True:
+                chunk = f.read(SMBIT_CHUNK_SIZE)
+                buf += chunk
+                end = 0
+                values, clocks = [], []
+                for match in SMBIT_RSSAVG_RE.finditer(buf):
+                    end = match.end()
+                    fields = dict(SMBIT_FIELD_RE.findall(match.group(1)))
+                    if fields.get('lastclock', '0') != '0':  # Add rsl if it is not empty
+                        values.append(fields['lastvalue'])
+                        clocks.append(fields['lastclock'])
+                if values:
+                    yield (np.array(values, dtype=np.float64),
+                           np.array(clocks, dtype=np.int64) + 7200)  # Add 2 hours to clock value
+                if not chunk:
+                    break
+                # keep only what may be the start of a record split between chunks
+                start = buf.rfind('siklu.rssavg', end)
+                buf = buf[start - 1:] if start > 0 else buf[-len('siklu.rssavg') - 1:]
+
+    def load_md(self, meta_path):
+        '''Returns the metadata of the .csv file meta_path with the standard columns,
+        to be passed as df_md to several calls.'''
+        return self._load_md(Path(meta_path))
+
+    def index_rd(self, rawdata_path, rd_index_file=None):
+        '''Returns the index of the raw-data files in rawdata_path, to be passed as
+        rd_index to several calls (rd_index_file as in the call).'''
+        self.rawdata_path = Path(rawdata_path)
+        self.rd_index_file = rd_index_file
+        return self._get_rd_index()
+
+    def _load_md(self, meta_path):
+        # returns the metadata with the standard columns
+        return self._md_defaults(self._read_md(meta_path))
+
+    def _stream_md(self, meta_path):
+        # returns the metadata read in chunks of rows, keeping of each chunk only the links
+        # that can be drawn: inside the area bounds that are set, not dropped, of the carriers
+        # and not kept already. Bounds that are not set become the extremes of all the links
+        # (as in _select_links), so that the links selected are the same as without chunks
+        # (unless the rows of a duplicated link id differ: the first one kept is drawn).
+        seen, kept = set(), []
+        extremes = {'longitude': [np.inf, -np.inf], 'latitude': [np.inf, -np.inf]}
+        to_drop = set(self.list_of_link_id_to_drop)
+        for df_md in self._read_md(meta_path, chunksize=self._stream_rows()):
+            df_md = self._md_defaults(df_md)
+            df_bool = df_md['rx site longitude'].astype(bool)
+            self.stats.skip('zero longitude', df_md.loc[~df_bool, 'link id'])
+            df_md = df_md[df_bool]
+            in_area = pd.Series(True, index=df_md.index)
+            for axis, (min_bound, max_bound) in (('longitude', (self.area_min_lon, self.area_max_lon)),
+                                                 ('latitude', (self.area_min_lat, self.area_max_lat))):
+                values = df_md[['rx site ' + axis, 'tx site ' + axis]]
+                extremes[axis][0] = np.fmin.reduce(values.values.ravel(), initial=extremes[axis][0])
+                extremes[axis][1] = np.fmax.reduce(values.values.ravel(), initial=extremes[axis][1])
+                if not math.isnan(min_bound):
+                    in_area &= (values > min_bound).all(axis=1)
+                if not math.isnan(max_bound):
+                    in_area &= (values < max_bound).all(axis=1)
+            self.stats.skip('out of area', df_md.loc[~in_area, 'link id'])
+            df_md = df_md[in_area]
+            dropped = df_md['link id'].isin(to_drop)
+            for link_id in df_md.loc[dropped, 'link id']:
+                print('link id' + str(link_id) + ' has been dropped')
+            self.stats.skip('dropped', df_md.loc[dropped, 'link id'])
+            df_md = df_md[~dropped]
+            if self.carriers is not None:
+                other_carrier = ~df_md['link carrier'].isin([str(c).lower() for c in self.carriers])
+                self.stats.skip('other carrier', df_md.loc[other_carrier, 'link id'])
+                df_md = df_md[~other_carrier]
+            duplicated = df_md['link id'].duplicated().values | \
+                         np.array([link_id in seen for link_id in df_md['link id']], dtype=bool)
+            self.stats.skip('duplicate link id', df_md.loc[duplicated, 'link id'])
+            df_md = df_md[~duplicated]
+            seen.update(df_md['link id'])
+            kept.append(df_md)
+        if not kept:
+            return self._load_md(meta_path)
+        for attr, axis, i in (('area_min_lon', 'longitude', 0), ('area_max_lon', 'longitude', 1),
+                              ('area_min_lat', 'latitude', 0), ('area_max_lat', 'latitude', 1)):
+            if math.isnan(getattr(self, attr)) and np.isfinite(extremes[axis][i]):
+                setattr(self, attr, extremes[axis][i])
+        return pd.concat(kept, ignore_index=True)
+
+    def _memory_budget(self):
+        # memory_budget_mb in bytes
+        return int(self.memory_budget_mb * 2 ** 20)
+
+    def _stream_rows(self):
+        # number of csv rows read at a time in streaming mode
+        return max(1000, self._memory_budget() // 4 // STREAM_ROW_BYTES)
+
+    def _md_defaults(self, df_md):
+        # default hop id and carrier, and lowercase carriers
+        if 'hop id' not in df_md.columns.values:
+            hop_id = 'not provided'
+            df_md['hop id'] = hop_id
+        if 'link carrier' not in df_md.columns.values:
+            carrier = 'unknown carrier'
+            df_md['link carrier'] = carrier
+        df_md['link carrier'] = df_md['link carrier'].str.lower()
+        return df_md
+
+    def _read_md(self, meta_path, chunksize=None):
+        # detect the metadata format from the header, then parse only its columns.
+        # With chunksize, returns an iterator of DataFrames of chunksize rows.
+        header = pd.read_csv(meta_path, nrows=0).columns
+        csv_cols = {col.lower(): col for col in header}
+        for schema_name, schema in MD_SCHEMAS.items():
+            found = {std_col for col, std_col in schema['columns'].items() if col in csv_cols}
+            if set(schema['required']).issubset(found):
+                break
+        else:
+            raise ValueError('Unknown metadata format of ' + str(meta_path) +
+                             ', known formats: ' + ', '.join(MD_SCHEMAS))
+        usecols = [csv_cols[col] for col in schema['columns'] if col in csv_cols]
+        dtype = {csv_cols[col]: MD_DTYPES[std_col] for col, std_col in schema['columns'].items()
+                 if col in csv_cols and std_col in MD_DTYPES}
+        reader = pd.read_csv(meta_path, usecols=usecols, dtype=dtype, chunksize=chunksize)
+        if chunksize:
+            return (self._standard_md(df_md, schema) for df_md in reader)
+        return self._standard_md(reader, schema)
+
+    def _standard_md(self, df_md, schema):
+        # rename the columns of a metadata format to the standard columns
+        df_md.columns = df_md.columns.str.lower()
+        df_md.rename(columns=schema['columns'], inplace=True)
+        process = schema.get('process')
+        if isinstance(process, str):
+            process = getattr(self, process)
+        if process:
+            df_md = process(df_md)
+        return df_md
+
     def _process_smbit_md(self, df):
         # usen in case the metadata file is not from Omnisol- SMBIT
         if 'link carrier' not in df.columns.values:
             carrier = 'smbit'
             df['link carrier'] = carrier
-        df_1 = df[['link carrier', 'hop_name', 'site1_longitude', 'site1_latitude',
-                   'site2_longitude', 'site2_latitude', 'up_valid_names']]
-        df_1.rename(columns={'hop_name':'hop id',
-                             'site1_longitude':'rx site longitude',
-                             'site1_latitude':'rx site latitude',
-                             'site2_longitude':'tx site longitude',
-                             'site2_latitude':'tx site latitude',
-                             'up_valid_names':'link id'}, inplace=True)
-        for i,row in df_1.iterrows():
-            try:
-                if ',' in row['link id']:
-                    str0 = row['link id'].split(',')[0]
-                    str1 = row['link id'].split(',')[1]
-                    df_1.iat[i, df_1.columns.get_loc('link id')] = str0
-                    df_1 = df_1.append(df_1.iloc[i], ignore_index=True)
-                    df_1.iat[-1, df_1.columns.get_loc('link id')] = str1
-            except:
-                pass
-
-        df_2 = df[['link carrier', 'hop_name', 'site1_longitude', 'site1_latitude',
-                   'site2_longitude', 'site2_latitude', 'down_valid_names']]
-        df_2.rename(columns={'hop_name': 'hop id',
-                             'site1_longitude': 'rx site longitude',
-                             'site1_latitude': 'rx site latitude',
-                             'site2_longitude': 'tx site longitude',
-                             'site2_latitude': 'tx site latitude',
-                             'down_valid_names': 'link id'}, inplace=True)
-        for i,row in df_2.iterrows():
-            try:
-                if ',' in row['link id']:
-                    str0 = row['link id'].split(',')[0]
-                    str1 = row['link id'].split(',')[1]
-                    df_2.iat[i, df_2.columns.get_loc('link id')] = str0
-                    df_2 = df_2.append(df_2.iloc[i], ignore_index=True)
-                    df_2.iat[-1, df_2.columns.get_loc('link id')] = str1
-            except:
-                pass
+        df_1 = self._split_valid_names(df, 'up_valid_names')
+        df_2 = self._split_valid_names(df, 'down_valid_names')
         df_new = pd.concat([df_1, df_2], ignore_index=True)
         df_new['link id'] = df_new['link id'].str.lower()
-        for i, row in df_new.iterrows():
-            try:
-                if 'siklu_' in row['link id']:
-                    str1 = row['link id'].split('siklu_')[1]
-                    df_new.iat[i, df_new.columns.get_loc('link id')] = str1
-            except:
-                pass
+        siklu = df_new['link id'].str.contains('siklu_', regex=False, na=False)
+        df_new.loc[siklu, 'link id'] = df_new.loc[siklu, 'link id'].str.split('siklu_').str[1]
         return df_new
 
+    def _split_valid_names(self, df, valid_names_col):
+        # one row per link of a hop- SMBIT. A hop lists up to two comma separated
+        # links: the first ones keep the order of the hops, the second ones follow.
+        df_ = df[['link carrier', 'hop_name', 'site1_longitude', 'site1_latitude',
+                  'site2_longitude', 'site2_latitude', valid_names_col]]
+        df_ = df_.rename(columns={'hop_name': 'hop id',
+                                  'site1_longitude': 'rx site longitude',
+                                  'site1_latitude': 'rx site latitude',
+                                  'site2_longitude': 'tx site longitude',
+                                  'site2_latitude': 'tx site latitude',
+                                  valid_names_col: 'link id'})
+        df_['link id'] = df_['link id'].str.split(',')
+        df_ = df_.explode('link id')
+        position = df_.groupby(level=0).cumcount().values
+        order = np.argsort(position[position < 2], kind='stable')
+        return df_[position < 2].iloc[order].reset_index(drop=True)
+
+
+def _init_rd_worker(state):
+    # a Draw_cml_map without a map, to process raw data in worker processes
+    global _rd_worker
+    _rd_worker = Draw_cml_map.__new__(Draw_cml_map)
+    _rd_worker.__dict__.update(state)
 
+def _rd_worker_job(link):
+    # returns the popups of the link and the stats of processing it
+    _rd_worker.stats = RunStats()
+    return _rd_worker._process_rd_link(link), _rd_worker.stats
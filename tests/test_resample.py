@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from draw_cml_map import Draw_cml_map
+
+
+def _drawer(resample):
+    drawer = Draw_cml_map()
+    drawer.resample = resample
+    drawer.interval = 15
+    drawer.aggregation = ('min', 'mean', 'max', 'availability')
+    return drawer
+
+
+def _rsl(dates):
+    return pd.DataFrame({'rsl': np.arange(len(dates)) % 7 - 50},
+                        index=pd.DatetimeIndex(dates, name='date'))
+
+
+def test_monthly_availability_counts_the_month_of_the_bucket():
+    dates = pd.date_range('2020-01-01', '2020-03-01', freq='15min', inclusive='left')
+    dates = dates[(dates < '2020-01-10') | (dates >= '2020-01-12')]
+    out = _drawer('M')._aggregate(_rsl(dates), 'rsl')
+    assert list(out.index) == [pd.Timestamp('2020-01-01'), pd.Timestamp('2020-02-01')]
+    assert out['availability'].iloc[0] == 29 / 31
+    assert out['availability'].iloc[1] == 1.0
+
+
+def test_streamed_partials_match_whole_series():
+    dates = pd.date_range('2020-01-01', '2020-03-01', freq='15min', inclusive='left')
+    df = _rsl(dates[dates.day != 5])
+    for resample in ('M', 'W', '6H'):
+        drawer = _drawer(resample)
+        partials = [df['rsl'].iloc[i:i + 1000].astype(float)
+                    .groupby(drawer._bucket_starts(df.index[i:i + 1000]))
+                    .agg(['min', 'max', 'sum', 'count'])
+                    for i in range(0, len(df), 1000)]
+        pd.testing.assert_frame_equal(
+            drawer._finish_partials(drawer._combine_partials(partials), 'rsl'),
+            drawer._aggregate(df, 'rsl'))